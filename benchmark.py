@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the poll -> parse -> ET0 -> publish pipeline
+
+Feeds the recorded responses in fixtures/ through the controller and
+forecast nodes, using an in-memory polyinterface (polystub) and a local
+stand-in for api.weatherstack.com (stub_server).  Reports latency
+percentiles and memory allocated for each stage and, optionally, writes
+a cProfile dump of full poll cycles.
+
+    python3 benchmark.py [-n 200] [--locations 1] [--profile poll.prof]
+
+With --drivers it instead measures the node driver tables as the number
+of locations and forecast nodes grows: memory per node and the time for
+setDriver by name, compared to a scan of the driver list.
+
+    python3 benchmark.py --drivers
+"""
+
+import polystub
+polystub.install()
+
+import argparse
+import cProfile
+import json
+import logging
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+
+import et3
+import stub_server
+import weatherstack
+import weatherstack_parse
+from weatherstack_units import CANONICAL
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+# The controller always requests metric, a fixture recorded in other units
+# would be read as metric
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r') as f:
+        payload = json.load(f)
+    unit = payload.get('request', {}).get('unit')
+    if unit != 'm':
+        raise SystemExit('%s is in units %s, fixtures need to be metric (m)' % (name, unit))
+    return payload
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = int(round((len(ordered) - 1) * pct / 100.0))
+    return ordered[index]
+
+
+class Stage(object):
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.samples = []
+        self.allocated = 0
+
+    def run(self, iterations):
+        for i in range(iterations):
+            start = time.perf_counter()
+            self.func()
+            self.samples.append(time.perf_counter() - start)
+
+    # Measured separately since tracing slows everything down
+    def measure_allocations(self, iterations):
+        tracemalloc.start()
+        peak = 0
+        for i in range(iterations):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            self.func()
+            peak += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        self.allocated = peak / iterations
+
+    def report(self):
+        ms = [s * 1000 for s in self.samples]
+        return '%-28s %9.3f %9.3f %9.3f %9.3f %10.1f' % (
+                self.name, percentile(ms, 50), percentile(ms, 90),
+                percentile(ms, 99), max(ms), self.allocated / 1024.0)
+
+
+# Stand-in responses, bulk queries get one response per location
+def responder(payload):
+    def respond(params):
+        count = len(params.get('query', '').split(';'))
+        if count > 1:
+            return [payload] * count
+        return payload
+    return respond
+
+
+def make_controller(url, locations, units):
+    names = ['Location %d' % i for i in range(locations)]
+    poly = polystub.Interface('WeatherStack', {
+        'Location': ';'.join(names),
+        'APIkey': 'benchmark',
+        'Units': units,
+        })
+    control = weatherstack.Controller(poly)
+    control.transport.base_url = url
+    control.transport.backoff = 0
+    state = tempfile.mkdtemp()
+    control.snapshot.path = os.path.join(state, 'snapshot.json')
+    control.scheduler.path = os.path.join(state, 'schedule.json')
+    control.set_location(';'.join(names))
+    control.apikey = 'benchmark'
+    control.units = units
+    control.configured = True
+    control.started = True
+    control.discover()
+    return control
+
+
+# Nodes for every location, with the daily and hourly forecast nodes
+def driver_table_nodes(locations, hours):
+    control = make_controller('', locations, 'imperial')
+    for index in range(locations):
+        for day in range(1, 7):
+            control.forecast_node(index, day)
+        for hour in range(1, hours + 1):
+            control.hourly_node(index, hour)
+    return control
+
+
+def time_setdriver(nodes, set_driver, rounds=20):
+    calls = 0
+    start = time.perf_counter()
+    for i in range(rounds):
+        for node in nodes:
+            for d in node.drivers:
+                set_driver(node, d['driver'], i)
+                calls += 1
+    return (time.perf_counter() - start) / calls
+
+
+def driver_tables():
+    print('%-9s %-6s %6s %10s %9s %12s %12s' % ('locations', 'hours', 'nodes', 'alloc KB',
+            'KB/node', 'indexed ns', 'scan ns'))
+    for locations in (1, 4, 16):
+        for hours in (0, 48):
+            tracemalloc.start()
+            control = driver_table_nodes(locations, hours)
+            allocated = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            nodes = [control] + list(control.nodes.values())
+            indexed = time_setdriver(nodes, lambda node, driver, value: node.setDriver(driver, value))
+            scan = time_setdriver(nodes, lambda node, driver, value: polystub.Node.setDriver(node, driver, value))
+            print('%-9d %-6d %6d %10.1f %9.2f %12.0f %12.0f' % (locations, hours, len(nodes),
+                    allocated / 1024.0, allocated / 1024.0 / len(nodes), indexed * 1e9, scan * 1e9))
+            control.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the weatherstack poll pipeline')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--locations', type=int, default=1)
+    parser.add_argument('--units', default='imperial', choices=['imperial', 'metric'])
+    parser.add_argument('--profile', metavar='FILE', help='write cProfile stats of full poll cycles to FILE')
+    parser.add_argument('--drivers', action='store_true', help='benchmark the node driver tables')
+    parser.add_argument('--debug', action='store_true', help='enable debug logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    if args.drivers:
+        driver_tables()
+        return
+
+    current = load_fixture('current.json')
+    forecast = load_fixture('forecast.json')
+    server = stub_server.StubServer({
+        'current': responder(current),
+        'forecast': responder(forecast),
+        })
+    server.start()
+
+    control = make_controller(server.url, args.locations, args.units)
+    # The forecast days are picked by date, so run as of the fixture
+    control.clock = lambda: forecast['location']['localtime_epoch']
+    node = control.forecast_node(0, 1)
+    fcast = next(weatherstack_parse.parse_forecast(forecast, CANONICAL, 1, 1))
+    latitude = float(forecast['location']['lat'])
+
+    def poll_cycle():
+        control.query_conditions(True)
+        control.query_forecast(True)
+        control.poller.wait()
+
+    # The same work done on this thread, so cProfile can see all of it
+    def sync_cycle():
+        control.new_conditions(control.fetch_conditions(True), True)
+        control.new_forecast(control.fetch_forecast(True), True)
+
+    stages = [
+        Stage('http current', lambda: control.fetch_conditions(True)),
+        Stage('http forecast', lambda: control.fetch_forecast(True)),
+        Stage('parse current', lambda: weatherstack_parse.parse_current(current, CANONICAL)),
+        Stage('parse forecast (6 days)', lambda: list(weatherstack_parse.parse_forecast(forecast, CANONICAL, 1, 6))),
+        Stage('update_conditions', lambda: control.update_conditions(0, current, True)),
+        Stage('update_forecast (6 days)', lambda: control.update_forecast(0, forecast, True)),
+        Stage('publish_forecast (rollover)', lambda: control.publish_forecast(0, False)),
+        Stage('DailyNode.update_forecast', lambda: node.update_forecast(fcast, latitude, 0, 0.23, CANONICAL, True)),
+        Stage('et3.evapotranspriation', lambda: et3.evapotranspriation(30.0, 15.0, None, 2.1, 100.0, 35, 35, latitude, 0.23, 250)),
+        Stage('poll cycle', poll_cycle),
+        ]
+
+    # Warm up connections, caches and solar tables
+    for stage in stages:
+        stage.func()
+
+    for stage in stages:
+        stage.run(args.iterations)
+        stage.measure_allocations(max(1, args.iterations // 10))
+
+    print('%d iterations, %d location(s), %s units' % (args.iterations, args.locations, args.units))
+    print('%-28s %9s %9s %9s %9s %10s' % ('stage (ms)', 'p50', 'p90', 'p99', 'max', 'alloc KB'))
+    for stage in stages:
+        print(stage.report())
+    print('driver updates sent: %d, requests served: %s' % (control.poly.sent, server.hits))
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        for i in range(args.iterations):
+            sync_cycle()
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print('\nprofile written to %s' % args.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+    control.stop()
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# In-memory stand-in for polyinterface
+#
+# Just enough of the polyinterface API for the node server to run without
+# Polyglot or an ISY, used by the benchmark and replay tools.  Driver
+# updates are kept in memory and counted instead of being sent anywhere.
+#
+# install() must be called before weatherstack is imported.
+
+import logging
+import sys
+
+LOGGER = logging.getLogger('polystub')
+
+
+class Node(object):
+    def __init__(self, controller, primary, address, name):
+        self.controller = controller
+        self.parent = controller
+        self.primary = primary
+        self.address = address
+        self.name = name
+        if controller is not None:
+            self.poly = controller.poly
+        self.updates = 0
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        for d in self.drivers:
+            if d['driver'] == driver:
+                d['value'] = value
+                if uom is not None:
+                    d['uom'] = uom
+                if report:
+                    self.reportDriver(d, report, force)
+                break
+
+    def reportDriver(self, driver, report, force):
+        self.updates += 1
+        self.poly.sent += 1
+
+    def reportDrivers(self):
+        for d in self.drivers:
+            self.reportDriver(d, True, False)
+
+    def getDriver(self, driver):
+        for d in self.drivers:
+            if d['driver'] == driver:
+                return d['value']
+        return None
+
+
+class Controller(Node):
+    def __init__(self, poly):
+        self.poly = poly
+        self.controller = self
+        self.parent = self
+        self.nodes = {}
+        self.notices = []
+        self.polyConfig = poly.config
+        self.updates = 0
+
+    def addNode(self, node):
+        self.nodes[node.address] = node
+        return node
+
+    def delNode(self, address):
+        self.nodes.pop(address, None)
+
+    def addCustomParam(self, params):
+        self.polyConfig['customParams'].update(params)
+
+    def addNotice(self, notice):
+        self.notices.append(notice)
+
+    def removeNoticesAll(self):
+        self.notices = []
+
+    def runForever(self):
+        pass
+
+
+class Interface(object):
+    def __init__(self, name='', params=None):
+        self.name = name
+        self.config = {'customParams': dict(params or {})}
+        self.config_handler = None
+        self.profiles = 0
+        self.sent = 0
+
+    def start(self):
+        pass
+
+    def onConfig(self, handler):
+        self.config_handler = handler
+
+    def installprofile(self):
+        self.profiles += 1
+
+    # Send a configuration change the way Polyglot would
+    def update_config(self, params):
+        self.config['customParams'] = dict(params)
+        if self.config_handler is not None:
+            self.config_handler(self.config)
+
+
+def install():
+    sys.modules['polyinterface'] = sys.modules[__name__]
@@ -0,0 +1,108 @@
+# Local stand-in for api.weatherstack.com
+#
+# Serves canned JSON responses on localhost so the node server can be
+# exercised without an API key or network access.  Responses are keyed
+# by endpoint name (current, forecast, ...) and may be either a payload
+# or a function that takes the query parameters and returns one.  A
+# (status, payload) tuple returns a non-200 status.
+
+import json
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer as ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+
+# A canned response recorded in other units than the request asks for
+# would be read as the wrong units.  Returns what's wrong, or None.
+def unit_mismatch(response, units):
+    if units is None:
+        return None
+    for payload in response if isinstance(response, list) else [response]:
+        unit = payload.get('request', {}).get('unit') if isinstance(payload, dict) else None
+        if unit is not None and unit != units:
+            return 'response is in units %s, the request asked for %s' % (unit, units)
+    return None
+
+
+class StubServer(object):
+    def __init__(self, responses, port=0):
+        self.responses = responses
+        self.delay = {}
+        self.hits = {}
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.port = port
+        self.httpd = None
+        self.url = ''
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 so that clients can keep the connection open
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, don't let Nagle
+            # delay the body
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                parts = urlparse(self.path)
+                endpoint = parts.path.strip('/')
+                params = dict(parse_qsl(parts.query))
+                status, body = stub.respond(endpoint, params, self.client_address)
+
+                data = json.dumps(body).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client gave up waiting (timeout tests)
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = 'http://127.0.0.1:%d/' % self.port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.url
+
+    def respond(self, endpoint, params, client):
+        with self.lock:
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+            self.clients.add(client)
+
+        if endpoint in self.delay:
+            time.sleep(self.delay[endpoint])
+
+        if endpoint not in self.responses:
+            return 404, {'success': False, 'error': {'code': 103, 'type': 'invalid_api_function'}}
+
+        response = self.responses[endpoint]
+        if callable(response):
+            response = response(params)
+        if isinstance(response, tuple):
+            return response
+        mismatch = unit_mismatch(response, params.get('units'))
+        if mismatch is not None:
+            return 400, {'success': False, 'error': {'code': 0, 'type': 'unit_mismatch', 'info': mismatch}}
+        return 200, response
+
+    # Number of distinct client connections seen so far
+    def connections(self):
+        return len(self.clients)
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
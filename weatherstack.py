@@ -11,14 +11,67 @@ except ImportError:
     import pgc_interface as polyinterface
     CLOUD = True
 import sys
-import requests
+import time
 import json
+import copy
+import datetime
+import et3
 import weatherstack_daily
+import weatherstack_forecast
+import weatherstack_hourly
+import weatherstack_location
+import weatherstack_balance
+import weatherstack_http
+import weatherstack_poller
+import weatherstack_cache
+import weatherstack_snapshot
+import weatherstack_publish
+import weatherstack_parse
+import weatherstack_units
+import weatherstack_schedule
+import weatherstack_flight
+import weatherstack_breaker
+import weatherstack_backfill
+import weatherstack_history
+import weatherstack_metrics
+import weatherstack_replay
+from weatherstack_metrics import METRICS
+from weatherstack_units import CANONICAL
 import write_profile
 
 LOGGER = polyinterface.LOGGER
 
-class Controller(polyinterface.Controller):
+# Node server status (ST)
+STATUS_OFFLINE = 0
+STATUS_ONLINE = 1
+STATUS_STALE = 2
+
+# Forecast days shown, day 1 is tomorrow
+FORECAST_DAYS = 6
+
+
+# Node addresses for the first location are the same as they've always
+# been, other locations are numbered.
+def location_address(index):
+    return 'location_' + str(index)
+
+def forecast_address(index, day):
+    if index == 0:
+        return 'forecast_' + str(day)
+    return 'forecast_%d_%d' % (index, day)
+
+def hourly_address(index, hour):
+    if index == 0:
+        return 'hourly_' + str(hour)
+    return 'hourly_%d_%d' % (index, hour)
+
+def balance_address(index):
+    if index == 0:
+        return 'balance'
+    return 'balance_' + str(index)
+
+
+class Controller(weatherstack_publish.IndexedDrivers, polyinterface.Controller):
     id = 'weatherstack'
     hint = [0,0,0,0]
     def __init__(self, polyglot):
@@ -27,12 +80,41 @@ class Controller(polyinterface.Controller):
         self.address = 'weatherstack'
         self.primary = self.address
         self.location = ''
+        self.locations = []
         self.apikey = ''
         self.units = 'imperial'
         self.configured = False
+        self.started = False
         self.myConfig = {}
         self.plant_type = 0.23
         self.elevation = 0
+        self.quota = 0
+        self.billing_day = 1
+        self.irrigation_threshold = weatherstack_balance.IRRIGATION_THRESHOLD
+        self.irrigation_rate = weatherstack_balance.IRRIGATION_RATE
+        self.forecast_mode = 'daily'
+        self.forecast_hours = weatherstack_hourly.MIN_HOURS
+        self.metrics_port = 0
+        self.record_directory = ''
+        self.backfill_days = 90
+        self.backfill_rate = weatherstack_backfill.DEFAULT_RATE
+        self.metrics_server = None
+        self.transport = weatherstack_http.Transport(LOGGER)
+        self.poller = weatherstack_poller.Poller(LOGGER)
+        self.cache = weatherstack_cache.ResponseCache()
+        self.flights = weatherstack_flight.SingleFlight()
+        self.history = weatherstack_history.History(LOGGER)
+        self.snapshot = weatherstack_snapshot.Snapshot(LOGGER)
+        self.scheduler = weatherstack_schedule.Scheduler(LOGGER)
+        self.breakers = {}
+        self.accumulators = {}
+        self.rings = {}
+        # The forecast days are picked by this time, a replay sets it to
+        # the recorded time
+        self.clock = time.time
+        self.backfiller = weatherstack_backfill.Backfill(LOGGER, self.fetch_history, self.store_history)
+        self.status = STATUS_ONLINE
+        self.profile_dir = write_profile.PROFILE_DIR
 
         self.poly.onConfig(self.process_config)
 
@@ -44,15 +126,72 @@ class Controller(polyinterface.Controller):
                 changed = False
                 if 'Location' in config['customParams']:
                     if self.location != config['customParams']['Location']:
-                        self.location = config['customParams']['Location']
+                        self.set_location(config['customParams']['Location'])
                         changed = True
+                        if self.started:
+                            self.discover()
                 if 'Elevation' in config['customParams']:
                     if self.elevation != config['customParams']['Elevation']:
                         self.elevation = config['customParams']['Elevation']
+                        self.set_et0_site()
+                        self.republish(('forecast',))
                         changed = True
                 if 'Plant Type' in config['customParams']:
                     if self.plant_type != config['customParams']['Plant Type']:
                         self.plant_type = config['customParams']['Plant Type']
+                        self.set_et0_site()
+                        self.republish(('forecast',))
+                        changed = True
+                if 'Monthly Quota' in config['customParams']:
+                    if self.quota != config['customParams']['Monthly Quota']:
+                        self.quota = config['customParams']['Monthly Quota']
+                        self.scheduler.set_quota(self.quota, self.billing_day)
+                        changed = True
+                if 'Billing Day' in config['customParams']:
+                    if self.billing_day != config['customParams']['Billing Day']:
+                        self.billing_day = config['customParams']['Billing Day']
+                        self.scheduler.set_quota(self.quota, self.billing_day)
+                        changed = True
+                if 'Irrigation Threshold' in config['customParams']:
+                    if self.irrigation_threshold != config['customParams']['Irrigation Threshold']:
+                        self.irrigation_threshold = config['customParams']['Irrigation Threshold']
+                        self.set_irrigation()
+                        changed = True
+                if 'Irrigation Rate' in config['customParams']:
+                    if self.irrigation_rate != config['customParams']['Irrigation Rate']:
+                        self.irrigation_rate = config['customParams']['Irrigation Rate']
+                        self.set_irrigation()
+                        changed = True
+                if 'Forecast Mode' in config['customParams']:
+                    if self.forecast_mode != config['customParams']['Forecast Mode']:
+                        self.forecast_mode = config['customParams']['Forecast Mode']
+                        self.set_forecast_mode()
+                        changed = True
+                if 'Forecast Hours' in config['customParams']:
+                    hours = weatherstack_hourly.forecast_hours(config['customParams']['Forecast Hours'])
+                    if self.forecast_hours != hours:
+                        self.forecast_hours = hours
+                        self.set_forecast_mode()
+                        changed = True
+                if 'Metrics Port' in config['customParams']:
+                    if self.metrics_port != config['customParams']['Metrics Port']:
+                        self.metrics_port = config['customParams']['Metrics Port']
+                        if self.started:
+                            self.start_metrics()
+                        changed = True
+                if 'Record Directory' in config['customParams']:
+                    if self.record_directory != config['customParams']['Record Directory']:
+                        self.record_directory = config['customParams']['Record Directory']
+                        self.set_recording()
+                        changed = True
+                if 'Backfill Days' in config['customParams']:
+                    if self.backfill_days != config['customParams']['Backfill Days']:
+                        self.backfill_days = config['customParams']['Backfill Days']
+                        changed = True
+                if 'Backfill Rate' in config['customParams']:
+                    if self.backfill_rate != config['customParams']['Backfill Rate']:
+                        self.backfill_rate = config['customParams']['Backfill Rate']
+                        self.backfiller.set_rate(self.backfill_rate)
                         changed = True
                 if 'APIkey' in config['customParams']:
                     if self.apikey != config['customParams']['APIkey']:
@@ -69,6 +208,7 @@ class Controller(polyinterface.Controller):
                                 self.set_driver_units()
                         except:
                             LOGGER.debug('set driver units failed')
+                        self.republish(('current', 'forecast'))
 
                 self.myConfig = config['customParams']
                 if changed:
@@ -84,31 +224,70 @@ class Controller(polyinterface.Controller):
 
     def start(self):
         LOGGER.info('Starting node server')
-        LOGGER.info('Add node for forecast')
-        for day in range(1,7):
-            address = 'forecast_' + str(day)
-            title = 'Forecast ' + str(day)
-
-            try:
-                node = weatherstack.DailyNode(self, self.address, address, title)
-                self.addNode(node);
-            except:
-                LOGGER.error('Failed to create forecast node ' + title)
-                LOGGER.debug('%s, %s, %s' % (self.address, address, title))
+        self.check_params()
 
+        # The water balance nodes start from the history
+        self.history.open()
 
-        self.check_params()
+        LOGGER.info('Add nodes for locations and forecasts')
+        self.started = True
+        self.discover()
         LOGGER.info('Node server started')
 
+        # Requests used so far this billing period
+        self.scheduler.load()
+        self.start_metrics()
+
+        # Fill in the last known values before going out to the network
+        self.restore_snapshot()
+
         # Do an initial query to get the data filled in as soon as possible
         self.query_conditions(True)
         self.query_forecast(True)
 
+        # Finish a backfill that was interrupted
+        if self.configured:
+            self.backfiller.resume()
+
+    # The polls only query the API when the scheduler says a new
+    # observation or forecast is due and the quota allows it.
     def shortPoll(self):
-        self.query_conditions(False)
+        self.check_rollover()
+        if self.scheduler.due('current'):
+            self.query_conditions(False, exclusive=True)
 
+    # The daily forecast is only fetched when the kept days don't cover
+    # the forecast nodes or are due for a refresh.
     def longPoll(self):
-        self.query_forecast(False)
+        if self.scheduler.due('forecast') and self.forecast_needed():
+            self.query_forecast(False, exclusive=True)
+
+    def forecast_needed(self):
+        if self.forecast_mode == 'hourly':
+            return True
+        for location in self.locations:
+            ring = self.rings.get(location)
+            if ring is None or ring.needs_fetch(FORECAST_DAYS, self.clock()):
+                return True
+        LOGGER.debug('Forecast still covers the next %d days, not fetching', FORECAST_DAYS)
+        return False
+
+    # When the date changes at a location, move its forecast nodes along
+    # a day from the kept forecast.
+    def check_rollover(self):
+        for index, location in enumerate(self.locations):
+            ring = self.rings.get(location)
+            if ring is None or ring.shown is None:
+                continue
+            today = ring.today(self.clock())
+            if today != ring.shown:
+                ring.shown = today
+                self.poller.defer(lambda i=index: self.shift_forecast(i))
+
+    def shift_forecast(self, index):
+        sent, skipped = self.publish_forecast(index, False)
+        LOGGER.info('New day for %s, forecast moved along: %d drivers updated, %d unchanged',
+                self.locations[index], sent, skipped)
 
     def icon_2_int(self, icn):
         return {
@@ -124,44 +303,281 @@ class Controller(polyinterface.Controller):
                 'partly-cloudy-night': 9,
                 }.get(icn, 0)
 
-    def query_conditions(self, force):
+    # Multiple locations are separated by semicolons
+    def set_location(self, location):
+        self.location = location
+        self.locations = [l.strip() for l in location.split(';') if l.strip() != '']
+
+    def api_units(self):
+        # m = metric, f = imperial.  Always metric, the drivers are
+        # converted to the configured units when they're published.
+        return 'm'
+
+    # The queries run in the background, the drivers are updated once
+    # the data arrives.  Polls are exclusive, a poll is skipped while the
+    # previous one is still running.
+    def query_conditions(self, force, exclusive=False):
+        self.poller.submit('current', lambda: self.fetch_conditions(force),
+                lambda results: self.new_conditions(results, force), exclusive)
+
+    def query_forecast(self, force, exclusive=False):
+        self.poller.submit('forecast', lambda: self.fetch_forecast(force),
+                lambda results: self.new_forecast(results, force), exclusive)
+
+    def new_conditions(self, results, force):
+        sent = skipped = 0
+        for index, location, jdata in results:
+            try:
+                counts = self.update_conditions(index, jdata, force)
+            except Exception as e:
+                LOGGER.error('Failed to update conditions for %s: %s', location, str(e))
+                continue
+            sent += counts[0]
+            skipped += counts[1]
+            self.snapshot.put('current', location, jdata, CANONICAL)
+        self.snapshot.flush()
+        LOGGER.info('Current conditions: %d drivers updated, %d unchanged', sent, skipped)
+        self.update_metrics()
+
+    def new_forecast(self, results, force):
+        sent = skipped = 0
+        for index, location, jdata in results:
+            try:
+                counts = self.update_forecast(index, jdata, force, self.clock())
+            except Exception as e:
+                LOGGER.error('Failed to update forecast for %s: %s', location, str(e))
+                continue
+            sent += counts[0]
+            skipped += counts[1]
+            self.snapshot.put('forecast', location, jdata, CANONICAL)
+        self.snapshot.flush()
+        LOGGER.info('Forecast: %d drivers updated, %d unchanged', sent, skipped)
+        self.update_metrics()
+
+    # Show the main metrics on the controller and update the gauges
+    def update_metrics(self):
+        remaining = self.scheduler.remaining()
+        METRICS.set('api_requests_used', self.scheduler.used)
+        if remaining is not None:
+            METRICS.set('api_requests_remaining', remaining)
+        for name, value in self.cache.stats().items():
+            METRICS.set('cache_' + name, value)
+        for name, value in self.flights.stats().items():
+            METRICS.set('flight_' + name, value)
+
+        self.driver_state.publish(self, {
+            'GV22': METRICS.percentile('http_request_seconds', 50) * 1000,
+            'GV23': METRICS.total('errors_total'),
+            'GV24': 0 if remaining is None else remaining,
+            'GV25': METRICS.total('driver_updates_total'),
+            })
+
+    # Save every API response to the Record Directory, if set, so it can be
+    # replayed later (see weatherstack_replay).
+    def set_recording(self):
+        if self.record_directory == '':
+            self.transport.recorder = None
+            return
+        LOGGER.info('Recording API responses to ' + self.record_directory)
+        self.transport.recorder = weatherstack_replay.Recorder(LOGGER, self.record_directory)
+        self.transport.recorder.units = self.units
+
+    # Serve the metrics on localhost if a Metrics Port is set
+    def start_metrics(self):
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        try:
+            port = int(self.metrics_port)
+        except (TypeError, ValueError):
+            LOGGER.error('Bad Metrics Port %s', str(self.metrics_port))
+            return
+        if port > 0:
+            self.metrics_server = weatherstack_metrics.MetricsServer(LOGGER, port)
+            if not self.metrics_server.start():
+                self.metrics_server = None
+
+    def restore_snapshot(self):
+        self.snapshot.load()
+        for index, location in enumerate(self.locations):
+            jdata = self.snapshot.get('current', location, CANONICAL)
+            if jdata is not None:
+                LOGGER.info('Restoring current conditions for %s from snapshot', location)
+                try:
+                    self.update_conditions(index, jdata, True)
+                except Exception as e:
+                    LOGGER.error('Failed to restore current conditions: %s', str(e))
+
+            jdata = self.snapshot.get('forecast', location, CANONICAL)
+            if jdata is not None:
+                LOGGER.info('Restoring forecast for %s from snapshot', location)
+                try:
+                    self.update_forecast(index, jdata, True)
+                except Exception as e:
+                    LOGGER.error('Failed to restore forecast: %s', str(e))
+
+    # Query the endpoint for every location that doesn't have a current
+    # response cached.  Returns a list of (index, location, response) for
+    # the responses that have new data or None when there's nothing new
+    # to publish.
+    #
+    # A location that is already being fetched by another query isn't
+    # requested again, its response is shared once it arrives.
+    def fetch(self, endpoint, params, force):
+        if not self.configured:
+            LOGGER.info('Skipping connection because we aren\'t configured yet.')
+            return None
+
+        leading = []
+        joined = []
+        for index, location in enumerate(self.locations):
+            key = (endpoint, location)
+            if force or self.cache.get(key) is None:
+                flight, leader = self.flights.join(key)
+                if not leader:
+                    joined.append((index, location, flight))
+                    continue
+                # Another leader may have cached its response and finished
+                # since the check above
+                cached = None if force else self.cache.get(key)
+                if cached is not None:
+                    self.flights.finish(key, cached)
+                    continue
+                leading.append((index, location, key))
+        if len(leading) == 0 and len(joined) == 0:
+            LOGGER.debug('%s data is still current, skipping query (%s)', endpoint, self.cache.stats())
+            return None
+
+        # While the API is failing for a location, skip its request and
+        # keep the last values
+        blocked = [l for l in leading if not self.breaker(endpoint, l[1]).allow()]
+        if len(blocked) > 0:
+            LOGGER.info('Skipping %s query for %s, the circuit is open',
+                    endpoint, ';'.join([l for i, l, k in blocked]))
+            METRICS.inc('breaker_skipped_total', len(blocked), endpoint=endpoint)
+            for index, location, key in blocked:
+                self.flights.finish(key, None)
+            leading = [l for l in leading if l not in blocked]
+            self.update_status()
+
+        results = []
+        if len(leading) > 0:
+            LOGGER.debug('request = %s %s', endpoint, ';'.join([l for i, l, k in leading]))
+            responses = []
+            try:
+                start = time.time()
+                responses = self.transport.get_many(endpoint, params, [l for i, l, k in leading])
+                self.schedule(endpoint, [l for i, l, k in leading], responses, start)
+            finally:
+                # Cache each response before finishing its flight, a caller
+                # that came along in between would find neither and make
+                # the request again.
+                responses += [None] * (len(leading) - len(responses))
+                for (index, location, key), jdata in zip(leading, responses):
+                    try:
+                        if jdata is not None and (self.cache_response(endpoint, key, jdata) or force):
+                            results.append((index, location, jdata))
+                    finally:
+                        self.flights.finish(key, jdata)
+
+        # The query that made the request publishes anything new, so a
+        # shared response only needs publishing here when forced.
+        if len(joined) > 0:
+            LOGGER.debug('%s: sharing in-flight requests for %s (%s)',
+                    endpoint, ';'.join([l for i, l, f in joined]), self.flights.stats())
+        for index, location, flight in joined:
+            jdata = self.flights.wait(flight)
+            if jdata is not None and force:
+                results.append((index, location, jdata))
+
+        if len(results) == 0:
+            LOGGER.debug('No new %s data, skipping update (%s)', endpoint, self.cache.stats())
+            return None
+        return results
+
+    # Returns True if the response has new data
+    def cache_response(self, endpoint, key, jdata):
+        if endpoint == 'current':
+            return self.cache.put_observation(key, jdata)
+        return self.cache.put_forecast(key, jdata)
+
+    # Let the scheduler know how the query went.  Each location counts as
+    # a request, even when they're fetched with a single bulk query.  The
+    # polls back off when every location failed, each location's breaker
+    # counts its own failures.
+    def schedule(self, endpoint, locations, responses, start):
+        for location, jdata in zip(locations, responses):
+            if jdata is None:
+                self.breaker(endpoint, location).failure()
+            else:
+                self.breaker(endpoint, location).success()
+
+        received = [jdata for jdata in responses if jdata is not None]
+        failed = len(responses) - len(received)
+        if failed > 0:
+            METRICS.inc('location_failures_total', failed, endpoint=endpoint)
+        if len(received) == 0:
+            self.scheduler.failure(endpoint, len(responses), self.transport.rate_limited >= start)
+            METRICS.inc('poll_failures_total', endpoint=endpoint)
+            self.update_status()
+            return
+
+        observed = None
+        if endpoint == 'current':
+            observed = weatherstack_cache.observation_epoch(received[0])
+            # The cache expires entries at the learned cadence too
+            self.cache.cadence = self.scheduler.cadence
+        self.scheduler.success(endpoint, len(responses), observed)
+        self.update_status()
+
+    # Each location has its own breaker for each endpoint, so one location
+    # that keeps failing doesn't stop the others.
+    def breaker(self, endpoint, location):
+        key = (endpoint, location)
+        if key not in self.breakers:
+            self.breakers[key] = weatherstack_breaker.CircuitBreaker(LOGGER, '%s %s' % key)
+        return self.breakers[key]
+
+    # ST shows the values as stale while the current conditions can't be
+    # fetched for one of the locations.  A failing forecast query only
+    # leaves the forecast nodes behind (and plans without forecasts always
+    # fail), so it doesn't.
+    def update_status(self):
+        open_count = {}
+        for (endpoint, location), breaker in list(self.breakers.items()):
+            open_count[endpoint] = open_count.get(endpoint, 0) + (1 if breaker.is_open() else 0)
+        for endpoint, count in open_count.items():
+            METRICS.set('breaker_open', count, endpoint=endpoint)
+        status = STATUS_ONLINE
+        if open_count.get('current', 0) > 0:
+            status = STATUS_STALE
+        if status != self.status:
+            self.status = status
+            # fetch() runs on a worker thread, drivers are set on the
+            # publish thread.
+            self.poller.defer(lambda: self.driver_state.publish(self, {'ST': status}))
+
+    def fetch_conditions(self, force):
         # Query for the current conditions. We can do this fairly
         # frequently, probably as often as once every 2 minutes.
         #
         # By default JSON is returned
 
-        request = 'http://api.weatherstack.com/current?'
         # TODO: handle other methods of setting location
-        request += 'access_key=' + self.apikey
-        request += '&query=' + self.location
-        request += '&unit=' + self.units  # m= metric, f = imperial
+        params = {
+                'access_key': self.apikey,
+                'units': self.api_units(),
+                }
 
-        # request += '&lang=' + self.language
+        # params['lang'] = self.language
 
-        LOGGER.debug('request = %s' % request)
+        return self.fetch('current', params, force)
 
-        if not self.configured:
-            LOGGER.info('Skipping connection because we aren\'t configured yet.')
-            return
-
-        c = requests.get(request)
-        jdata = c.json()
-        LOGGER.debug(jdata)
-
-        # All data is available in both metric and imperial so the self.units
-        # setting will determine which bit of data to use.
-        self.setDriver('CLITEMP', float(jdata['current']['temperature']), True, force)
-        self.setDriver('BARPRES', float(jdata['current']['pressure']), True, force)
-        self.setDriver('CLIHUM', float(jdata['current']['humidity']), True, force)
-        self.setDriver('GV4', float(jdata['current']['wind_speed']), True, force)
-        #self.setDriver('GV5', float(jdata['current']['gust_kph']), True, force)
-        self.setDriver('WINDDIR', float(jdata['current']['wind_degree']), True, force)
-        self.setDriver('GV14', float(jdata['current']['cloudcover']), True, force)
-        self.setDriver('GV2', float(jdata['current']['feelslike_c']), True, force)
-        self.setDriver('GV16', float(jdata['current']['uv_index']), True, True)
-        self.setDriver('GV6', float(jdata['current']['precip']), True, force)
-        self.setDriver('GV15', float(jdata['current']['visibility']), True, force)
-        self.setDriver('GV13', float(jdata['current']['weather_code']), True, force)
+    # Returns the number of drivers updated and skipped.  If record is
+    # False the conditions are only published, not added to the history
+    # and water balance.
+    def update_conditions(self, index, jdata, force, record=True):
+        LOGGER.debug('%s', weatherstack_metrics.LazyJSON(jdata))
 
         # last update time:  jdata['last_updated_epoch']
         # condition code: jdata['condition']['code'] ??
@@ -169,53 +585,211 @@ class Controller(polyinterface.Controller):
 
         # is there a location object with lat and lon we can use?
 
-    def query_forecast(self, force):
-        # Not available with free plan!
-        request = 'http://api.weatherstack.com/forecast?'
-        request += 'access_key=' + self.apikey
-        request += '&query=' + self.location
-        request += '&forecast_days=8'
+        with METRICS.timer('parse_seconds', kind='current'):
+            conditions = weatherstack_parse.parse_current(jdata, CANONICAL)
+        if conditions.missing:
+            LOGGER.warning('Current conditions are missing %s', ', '.join(conditions.missing))
 
-        # request += '&lang=' + self.language
+        location = self.locations[index]
+        observed = weatherstack_cache.observation_epoch(jdata)
+        if record:
+            self.accumulate(location, jdata, observed, conditions)
+            self.history.add_observation(location, observed, conditions, CANONICAL)
+        et0 = self.et0_today(location)
 
-        LOGGER.debug('request = %s' % request)
+        if index > 0:
+            sent, skipped = self.nodes[location_address(index)].update_conditions(conditions, force, et0)
+        else:
+            # Only send the drivers that changed
+            values = weatherstack_units.display(conditions.values(), self.units)
+            if et0 is not None:
+                values['GV7'] = et0
+            sent, skipped = self.driver_state.publish(self, values, force)
 
-        if not self.configured:
-            LOGGER.info('Skipping connection because we aren\'t configured yet.')
+        balance = self.nodes[balance_address(index)]
+        if record and observed is not None:
+            balance.add_observation(observed, conditions.GV6)
+        counts = balance.update(force)
+        return sent + counts[0], skipped + counts[1]
+
+    # Add an observation to the location's running ETo for today.  The
+    # first time, the day so far is filled in from the history.
+    def accumulate(self, location, jdata, observed, conditions):
+        if observed is None:
             return
+        accumulator = self.accumulators.get(location)
+        if accumulator is None:
+            try:
+                latitude = float(jdata['location']['lat'])
+                longitude = float(jdata['location']['lon'])
+            except (KeyError, TypeError, ValueError):
+                return
+            # The day starts at the location's midnight, the same as the
+            # forecast days
+            offset = weatherstack_parse.utc_offset(jdata)
+            accumulator = et3.HourlyAccumulator(latitude, longitude, float(self.elevation), float(self.plant_type),
+                    utc_offset=offset)
+            for row in self.history.range('observations', location, et3.local_midnight(observed, offset), observed):
+                accumulator.add(row[1], row[2], row[3], row[5])
+            self.accumulators[location] = accumulator
+
+        else:
+            # Daylight saving time changes the offset
+            accumulator.utc_offset = weatherstack_parse.utc_offset(jdata)
+
+        if accumulator.day_end is not None and observed >= accumulator.day_end:
+            LOGGER.info('%s, yesterday: ETo = %.2f mm, humidity %s - %s %%, mean wind %s m/s',
+                    location, accumulator.et0, accumulator.min_h, accumulator.max_h, accumulator.mean_wind())
+
+        wind = conditions.GV4
+        if wind is not None:
+            wind = weatherstack_units.to_si('speed', CANONICAL)(wind)
+        accumulator.add(observed, conditions.CLITEMP, conditions.CLIHUM, wind, conditions.GV14)
+
+    # ETo so far today (mm), None until there are observations
+    def et0_today(self, location):
+        accumulator = self.accumulators.get(location)
+        if accumulator is None:
+            return None
+        return max(accumulator.et0, 0.0)
+
+    def set_et0_site(self):
+        for accumulator in self.accumulators.values():
+            accumulator.elevation = float(self.elevation)
+            accumulator.canopy_coefficient = float(self.plant_type)
+        for ring in self.rings.values():
+            ring.clear_et0()
+
+    def fetch_forecast(self, force):
+        # Not available with free plan!
+        params = {
+                'access_key': self.apikey,
+                'forecast_days': 8,
+                }
+        if self.forecast_mode == 'hourly':
+            params['hourly'] = 1
+            params['interval'] = 1
+
+        # params['lang'] = self.language
 
-        c = requests.get(request)
-        jdata = c.json()
+        return self.fetch('forecast', params, force)
+
+    # Keep the days of the forecast and publish them.  fetched is the time
+    # the response was received, None for a saved response.  Returns the
+    # number of drivers updated and skipped.
+    def update_forecast(self, index, jdata, force, fetched=None):
         #LOGGER.debug(jdata)
-        # Daily data is 7 day forecast, index 0 is today
-        for day in range(1,7):
-            address = 'forecast_' + str(day)
-            forecast = jdata['forecast']['forecastday'][day]
-            fcast = {}
-
-            LOGGER.debug(forecast)
-
-            fcast['time'] = forecast['date_epoch']
-            fcast['code'] = forecast['day']['condition']['code']
-            fcast['avghumidity'] = forecast['day']['avghumidity']
-            fcast['uv'] = forecast['day']['uv']
-            LOGGER.info('** Found forecast for %s %d' % (forecast['date'], fcast['code']))
-            if self.units == 'metric':
-                fcast['mintemp'] = forecast['day']['mintemp_c']
-                fcast['maxtemp'] = forecast['day']['maxtemp_c']
-                fcast['totalprecip'] = forecast['day']['totalprecip_mm']
-                fcast['avgvis'] = forecast['day']['avgvis_km']
-                fcast['maxwind'] = forecast['day']['maxwind_kph']
-            else:
-                fcast['mintemp'] = forecast['day']['mintemp_f']
-                fcast['maxtemp'] = forecast['day']['maxtemp_f']
-                fcast['totalprecip'] = forecast['day']['totalprecip_in']
-                fcast['avgvis'] = forecast['day']['avgvis_miles']
-                fcast['maxwind'] = forecast['day']['maxwind_mph']
+        # Daily data is 8 day forecast, index 0 is today
+        with METRICS.timer('parse_seconds', kind='forecast'):
+            days = list(weatherstack_parse.parse_forecast(jdata, CANONICAL))
+        for fcast in days:
+            LOGGER.info('** Found forecast for %s %s', fcast.date, fcast.code)
 
-            self.nodes[address].update_forecast(fcast, jdata['location']['lat'], self.elevation, self.plant_type, self.units)
-        
-    def query(self):
+        location = self.locations[index]
+        ring = self.rings.get(location)
+        if ring is None:
+            ring = self.rings[location] = weatherstack_forecast.ForecastRing()
+        ring.set_location(jdata)
+
+        # Only the days that are new or changed need their ETo calculated
+        changed = ring.put(days, fetched)
+        with METRICS.timer('et0_seconds'):
+            et0 = weatherstack_daily.forecast_et0([slot.day for slot in changed],
+                    ring.latitude, self.elevation, self.plant_type, CANONICAL)
+        for slot, day_et0 in zip(changed, et0):
+            slot.et0 = day_et0
+        LOGGER.debug('%s: ETo calculated for %d of %d forecast days', location, len(changed), len(days))
+
+        if len(changed) > 0:
+            self.history.add_forecast(location, [slot.day for slot in changed], et0, CANONICAL)
+        LOGGER.info('%s, last 7 days: ETo = %.2f mm, rain = %.2f mm',
+                location, *self.history.rolling(location))
+
+        sent, skipped = self.publish_forecast(index, force)
+
+        if self.forecast_mode == 'hourly':
+            counts = self.update_hourly(index, jdata, force)
+            sent += counts[0]
+            skipped += counts[1]
+
+        return sent, skipped
+
+    # Publish the days after the location's today from the kept forecast
+    # to the forecast nodes and the water balance.  Returns the number of
+    # drivers updated and skipped.
+    def publish_forecast(self, index, force):
+        ring = self.rings[self.locations[index]]
+        ring.shown = ring.today(self.clock())
+        sent = skipped = 0
+        outlook = []
+        for day, slot in enumerate(ring.window(ring.shown + 1, FORECAST_DAYS), 1):
+            if slot is None:
+                break
+            outlook.append(slot)
+            node = self.forecast_node(index, day)
+            if node is None:
+                continue
+            counts = node.update_forecast(slot.day, ring.latitude, self.elevation, self.plant_type, CANONICAL, force, slot.et0)
+            sent += counts[0]
+            skipped += counts[1]
+
+        balance = self.nodes[balance_address(index)]
+        balance.set_forecast([slot.day for slot in outlook], [slot.et0 for slot in outlook], CANONICAL)
+        counts = balance.update(force)
+        sent += counts[0]
+        skipped += counts[1]
+        return sent, skipped
+
+    # Update the hourly nodes, starting with the next hour.  Returns the
+    # number of drivers updated and skipped.
+    def update_hourly(self, index, jdata, force):
+        start = (int(self.clock()) // 3600 + 1) * 3600
+        sent = skipped = 0
+        hours = weatherstack_parse.parse_hourly(jdata, CANONICAL, start, self.forecast_hours)
+        for hour, record in enumerate(hours, 1):
+            node = self.hourly_node(index, hour)
+            if node is None:
+                continue
+            if record.missing:
+                LOGGER.debug('Hour %d forecast is missing %s', hour, ', '.join(record.missing))
+            counts = node.update_hourly(record, force)
+            sent += counts[0]
+            skipped += counts[1]
+        return sent, skipped
+
+    # Publish the last responses again without making any requests, after
+    # a change to the units or to the ETo inputs.  The responses are kept
+    # in canonical units (see weatherstack_units) so only the conversion
+    # for display and the ETo need to be redone.  Runs on the publish
+    # thread, in order with the poll updates.
+    def republish(self, kinds):
+        if self.started:
+            self.poller.defer(lambda: self.publish_saved(kinds))
+
+    def publish_saved(self, kinds):
+        sent = skipped = 0
+        for index, location in enumerate(self.locations):
+            for kind in kinds:
+                jdata = self.snapshot.get(kind, location, CANONICAL)
+                if jdata is None:
+                    continue
+                try:
+                    if kind == 'current':
+                        counts = self.update_conditions(index, jdata, True, False)
+                    else:
+                        counts = self.update_forecast(index, jdata, True)
+                except Exception as e:
+                    LOGGER.error('Failed to republish %s for %s: %s', kind, location, str(e))
+                    continue
+                sent += counts[0]
+                skipped += counts[1]
+        LOGGER.info('Republished %s: %d drivers updated, %d unchanged', ', '.join(kinds), sent, skipped)
+
+    # The ISY's query refreshes anything that is out of date, sharing any
+    # request that a poll already has in progress.
+    def query(self, command=None):
+        self.query_conditions(False)
+        self.query_forecast(False)
         for node in self.nodes:
             self.nodes[node].reportDrivers()
 
@@ -223,12 +797,146 @@ class Controller(polyinterface.Controller):
         # Create any additional nodes here
         LOGGER.info("In Discovery...")
 
+        # The first location's conditions are on the controller node,
+        # every other location gets its own node.  Each location has its
+        # own set of forecast nodes.
+        for index, location in enumerate(self.locations):
+            primary = self.location_primary(index)
+            if index > 0 and primary not in self.nodes:
+                LOGGER.info('Add node for ' + location)
+                try:
+                    node = weatherstack_location.LocationNode(self, primary, primary, location)
+                    node.set_units(self.units)
+                    self.addNode(node)
+                except:
+                    LOGGER.error('Failed to create location node ' + location)
+
+            address = balance_address(index)
+            if address not in self.nodes:
+                title = 'Water Balance'
+                if index > 0:
+                    title = location + ' ' + title
+                try:
+                    node = weatherstack_balance.WaterBalanceNode(self, primary, address, title)
+                    node.set_units(self.units)
+                    node.set_irrigation(self.irrigation_threshold, self.irrigation_rate)
+                    self.seed_balance(node, location)
+                    self.addNode(node)
+                except:
+                    LOGGER.error('Failed to create water balance node ' + title)
+
+        # Forecast nodes are added when there's a forecast for them, see
+        # forecast_node and hourly_node.
+
+    def location_primary(self, index):
+        if index == 0:
+            return self.address
+        return location_address(index)
+
+    # Return the forecast node for a location's day, adding it if needed.
+    # Returns None if it couldn't be added.
+    def forecast_node(self, index, day):
+        address = forecast_address(index, day)
+        if address in self.nodes:
+            return self.nodes[address]
+
+        title = 'Forecast ' + str(day)
+        if index > 0:
+            title = self.locations[index] + ' ' + title
+        return self.add_forecast_node(weatherstack_daily.DailyNode, index, address, title)
+
+    def hourly_node(self, index, hour):
+        address = hourly_address(index, hour)
+        if address in self.nodes:
+            return self.nodes[address]
+
+        title = 'Forecast +%d hour%s' % (hour, '' if hour == 1 else 's')
+        if index > 0:
+            title = self.locations[index] + ' ' + title
+        return self.add_forecast_node(weatherstack_hourly.HourlyNode, index, address, title)
+
+    def add_forecast_node(self, node_class, index, address, title):
+        primary = self.location_primary(index)
+        try:
+            node = node_class(self, primary, address, title)
+            node.set_units(self.units)
+            self.addNode(node)
+            return node
+        except:
+            LOGGER.error('Failed to create forecast node ' + title)
+            LOGGER.debug('%s, %s, %s', primary, address, title)
+            return None
+
+    # Forecast Mode or Forecast Hours changed.  Hourly nodes past the
+    # horizon are removed and the next forecast is fetched with (or
+    # without) the hourly data.
+    def set_forecast_mode(self):
+        self.forecast_mode = weatherstack_hourly.forecast_mode(self.forecast_mode)
+        keep = self.forecast_hours if self.forecast_mode == 'hourly' else 0
+        for index in range(len(self.locations)):
+            for hour in range(keep + 1, weatherstack_hourly.MAX_HOURS + 1):
+                address = hourly_address(index, hour)
+                if address in self.nodes:
+                    LOGGER.info('Removing node ' + address)
+                    self.delNode(address)
+                    self.nodes.pop(address, None)
+
+        for location in self.locations:
+            self.cache.invalidate(('forecast', location))
+        if self.started:
+            self.query_forecast(True)
+
+    # Carry on with the saved water balance, or start it from the last
+    # week of history.  After that it's updated as observations and
+    # forecasts arrive, and saved as it changes.
+    def seed_balance(self, node, location):
+        now = time.time()
+        today = weatherstack_balance.date_of(now)
+        et0_today = self.history.day_et0(location, weatherstack_history.date_key(today))
+        state = self.history.load_balance(location)
+        if state is not None:
+            node.restore(state)
+            if node.day < today:
+                # Catch up on the days the node server wasn't running
+                start = node.last_observed or weatherstack_balance.day_epoch(node.day)
+                node.rain += self.history.rain_total(location, start - start % 3600 + 3600,
+                        weatherstack_balance.day_epoch(today))
+                for date in weatherstack_balance.dates(node.day, today):
+                    node.et0[date] = self.history.day_et0(location, weatherstack_history.date_key(date))
+                node.rollover(today)
+            if et0_today:
+                node.et0[today] = et0_today
+            LOGGER.info('%s water deficit restored, %.2f mm', location, node.deficit)
+        else:
+            start = weatherstack_balance.days_before(today, 7)
+            et0 = self.history.et0_total(location, weatherstack_history.date_key(start),
+                    weatherstack_history.date_key(today))
+            rain = self.history.rain_total(location, weatherstack_balance.day_epoch(start),
+                    weatherstack_balance.day_epoch(today))
+            node.seed(et0 - rain, et0_today, now)
+            LOGGER.info('%s water deficit starts at %.2f mm', location, node.deficit)
+        node.persist = lambda state: self.history.save_balance(location, state)
+        node.save()
+
+    def set_irrigation(self):
+        for index in range(len(self.locations)):
+            address = balance_address(index)
+            if address in self.nodes:
+                self.nodes[address].set_irrigation(self.irrigation_threshold, self.irrigation_rate)
+
     # Delete the node server from Polyglot
     def delete(self):
         LOGGER.info('Removing node server')
 
     def stop(self):
         LOGGER.info('Stopping node server')
+        self.setDriver('ST', STATUS_OFFLINE)
+        self.backfiller.stop()
+        self.poller.stop()
+        self.transport.close()
+        self.history.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
 
     def update_profile(self, command):
         st = self.poly.installprofile()
@@ -237,7 +945,7 @@ class Controller(polyinterface.Controller):
     def check_params(self):
 
         if 'Location' in self.polyConfig['customParams']:
-            self.location = self.polyConfig['customParams']['Location']
+            self.set_location(self.polyConfig['customParams']['Location'])
         if 'APIkey' in self.polyConfig['customParams']:
             self.apikey = self.polyConfig['customParams']['APIkey']
         if 'Elevation' in self.polyConfig['customParams']:
@@ -248,6 +956,29 @@ class Controller(polyinterface.Controller):
             self.units = self.polyConfig['customParams']['Units']
         else:
             self.units = 'imperial';
+        if 'Monthly Quota' in self.polyConfig['customParams']:
+            self.quota = self.polyConfig['customParams']['Monthly Quota']
+        if 'Billing Day' in self.polyConfig['customParams']:
+            self.billing_day = self.polyConfig['customParams']['Billing Day']
+        if 'Irrigation Threshold' in self.polyConfig['customParams']:
+            self.irrigation_threshold = self.polyConfig['customParams']['Irrigation Threshold']
+        if 'Irrigation Rate' in self.polyConfig['customParams']:
+            self.irrigation_rate = self.polyConfig['customParams']['Irrigation Rate']
+        if 'Forecast Mode' in self.polyConfig['customParams']:
+            self.forecast_mode = weatherstack_hourly.forecast_mode(self.polyConfig['customParams']['Forecast Mode'])
+        if 'Forecast Hours' in self.polyConfig['customParams']:
+            self.forecast_hours = weatherstack_hourly.forecast_hours(self.polyConfig['customParams']['Forecast Hours'])
+        if 'Metrics Port' in self.polyConfig['customParams']:
+            self.metrics_port = self.polyConfig['customParams']['Metrics Port']
+        if 'Record Directory' in self.polyConfig['customParams']:
+            self.record_directory = self.polyConfig['customParams']['Record Directory']
+        if 'Backfill Days' in self.polyConfig['customParams']:
+            self.backfill_days = self.polyConfig['customParams']['Backfill Days']
+        if 'Backfill Rate' in self.polyConfig['customParams']:
+            self.backfill_rate = self.polyConfig['customParams']['Backfill Rate']
+        self.set_recording()
+        self.scheduler.set_quota(self.quota, self.billing_day)
+        self.backfiller.set_rate(self.backfill_rate)
 
         self.configured = True
 
@@ -256,9 +987,19 @@ class Controller(polyinterface.Controller):
             'APIkey': self.apikey,
             'Units': self.units,
             'Elevation': self.elevation,
-            'Plant Type': self.plant_type} )
+            'Plant Type': self.plant_type,
+            'Monthly Quota': self.quota,
+            'Billing Day': self.billing_day,
+            'Irrigation Threshold': self.irrigation_threshold,
+            'Irrigation Rate': self.irrigation_rate,
+            'Forecast Mode': self.forecast_mode,
+            'Forecast Hours': self.forecast_hours,
+            'Metrics Port': self.metrics_port,
+            'Record Directory': self.record_directory,
+            'Backfill Days': self.backfill_days,
+            'Backfill Rate': self.backfill_rate} )
 
-        LOGGER.info('api id = %s' % self.apikey)
+        LOGGER.info('api id = %s', self.apikey)
 
         self.removeNoticesAll()
         if self.location == '':
@@ -275,89 +1016,100 @@ class Controller(polyinterface.Controller):
 
     def set_cloud_driver_units(self):
         LOGGER.info('Configure driver units to ' + self.units)
-        if self.units == 'metric':
-            for drv in self.drivers:
-                if drv == 'CLITEMP': self.drivers[drv]['uom'] = 4
-                if drv == 'DEWPT': self.drivers[drv]['uom'] = 4
-                if drv == 'GV0': self.drivers[drv]['uom'] = 4
-                if drv == 'GV1': self.drivers[drv]['uom'] = 4
-                if drv == 'GV2': self.drivers[drv]['uom'] = 4
-                if drv == 'GV3': self.drivers[drv]['uom'] = 4
-                if drv == 'BARPRES': self.drivers[drv]['uom'] = 117
-                if drv == 'GV4': self.drivers[drv]['uom'] = 49
-                if drv == 'GV5': self.drivers[drv]['uom'] = 49
-                if drv == 'GV6': self.drivers[drv]['uom'] = 82
-                if drv == 'GV15': self.drivers[drv]['uom'] = 38
-            for day in range(1,7):
-                address = 'forecast_' + str(day)
-                self.nodes[address].set_units('metric')
-        else:
-            for drv in self.drivers:
-                if drv == 'CLITEMP': self.drivers[drv]['uom'] = 17
-                if drv == 'DEWPT': self.drivers[drv]['uom'] = 17
-                if drv == 'GV0': self.drivers[drv]['uom'] = 17
-                if drv == 'GV1': self.drivers[drv]['uom'] = 17
-                if drv == 'GV2': self.drivers[drv]['uom'] = 17
-                if drv == 'GV3': self.drivers[drv]['uom'] = 17
-                if drv == 'BARPRES': self.drivers[drv]['uom'] = 23
-                if drv == 'GV4': self.drivers[drv]['uom'] = 48
-                if drv == 'GV5': self.drivers[drv]['uom'] = 48
-                if drv == 'GV6': self.drivers[drv]['uom'] = 105
-                if drv == 'GV15': self.drivers[drv]['uom'] = 116
-            for day in range(1,7):
-                address = 'forecast_' + str(day)
-                self.nodes[address].set_units('imperial')
+        weatherstack_units.apply(self.drivers, self.units)
+        self.set_node_units(self.units)
+
+        # Values need to be resent with the new units
+        self.driver_state.reset()
 
     def set_driver_units(self):
         LOGGER.info('Configure drivers ---')
-        if self.units == 'metric':
-            for driver in self.drivers:
-                if driver['driver'] == 'CLITEMP': driver['uom'] = 4
-                if driver['driver'] == 'DEWPT': driver['uom'] = 4
-                if driver['driver'] == 'BARPRES': driver['uom'] = 117
-                if driver['driver'] == 'GV0': driver['uom'] = 4
-                if driver['driver'] == 'GV1': driver['uom'] = 4
-                if driver['driver'] == 'GV2': driver['uom'] = 4
-                if driver['driver'] == 'GV3': driver['uom'] = 4
-                if driver['driver'] == 'GV4': driver['uom'] = 49
-                if driver['driver'] == 'GV5': driver['uom'] = 49
-                if driver['driver'] == 'GV6': driver['uom'] = 82
-                if driver['driver'] == 'GV15': driver['uom'] = 38
-            for day in range(1,7):
-                address = 'forecast_' + str(day)
-                self.nodes[address].set_units('metric')
-
-        # Write out a new node definition file here.
-        else:  # imperial
-            for driver in self.drivers:
-                if driver['driver'] == 'CLITEMP': driver['uom'] = 17
-                if driver['driver'] == 'DEWPT': driver['uom'] = 17
-                if driver['driver'] == 'BARPRES': driver['uom'] = 23
-                if driver['driver'] == 'GV0': driver['uom'] = 17
-                if driver['driver'] == 'GV1': driver['uom'] = 17
-                if driver['driver'] == 'GV2': driver['uom'] = 17
-                if driver['driver'] == 'GV3': driver['uom'] = 17
-                if driver['driver'] == 'GV4': driver['uom'] = 48
-                if driver['driver'] == 'GV5': driver['uom'] = 48
-                if driver['driver'] == 'GV6': driver['uom'] = 105
-                if driver['driver'] == 'GV15': driver['uom'] = 116
-            for day in range(1,7):
-                address = 'forecast_' + str(day)
-                self.nodes[address].set_units('imperial')
-
-        # Write out a new node definition file here.
+        weatherstack_units.apply(self.drivers, self.units)
+        self.set_node_units(self.units)
+
+        # Values need to be resent with the new units
+        self.driver_state.reset()
+
+        # Write out a new node definition file here, it only needs to be
+        # published to the ISY if it changed.
         LOGGER.info('Write new node definitions and publish to ISY')
-        write_profile.write_profile(LOGGER, self.drivers, self.nodes['forecast_1'].drivers)
-        self.poly.installprofile()
+        if write_profile.write_profile(LOGGER, profile_nodes(self.units), self.profile_dir):
+            self.poly.installprofile()
+
+    def set_node_units(self, units):
+        for address in self.nodes:
+            if address != self.address:
+                self.nodes[address].set_units(units)
+        if self.transport.recorder is not None:
+            self.transport.recorder.units = units
 
     def remove_notices_all(self, command):
         self.removeNoticesAll()
 
+    # Fill in the history for the last Backfill Days days from the
+    # historical endpoint (see weatherstack_backfill).  Runs in the
+    # background.
+    def backfill(self, command=None):
+        if not self.configured:
+            LOGGER.info('Skipping backfill because we aren\'t configured yet.')
+            return
+        try:
+            days = max(1, int(self.backfill_days))
+        except (TypeError, ValueError):
+            LOGGER.error('Bad Backfill Days %s', str(self.backfill_days))
+            return
+        last = datetime.date.today() - datetime.timedelta(days=1)
+        first = last - datetime.timedelta(days=days - 1)
+        self.backfiller.start(self.locations, first, last)
+
+    # One backfill request, on a backfill thread.  Half of a monthly quota
+    # is kept for the polls.
+    def fetch_history(self, location, first, last):
+        remaining = self.scheduler.remaining()
+        if remaining is not None and remaining <= self.scheduler.quota // 2:
+            LOGGER.warning('Not backfilling %s, the rest of the monthly quota is for the polls', location)
+            return None
+        breaker = self.breaker('historical', location)
+        if not breaker.allow():
+            return None
+
+        params = {
+                'access_key': self.apikey,
+                'units': self.api_units(),
+                'historical_date_start': first,
+                'historical_date_end': last,
+                'hourly': 1,
+                'interval': weatherstack_backfill.INTERVAL,
+                }
+        jdata = self.transport.get_one('historical', params, location)
+        self.scheduler.count('historical', 1, time.time())
+        if jdata is None or 'historical' not in jdata:
+            breaker.failure()
+            jdata = None
+        else:
+            breaker.success()
+        self.update_status()
+        return jdata
+
+    # Calculate the ETo for a backfilled range and add it to the history
+    def store_history(self, location, jdata):
+        days = list(weatherstack_parse.parse_historical(jdata, CANONICAL))
+        if len(days) == 0:
+            return
+        latitude = float(jdata['location']['lat'])
+        with METRICS.timer('et0_seconds'):
+            et0 = weatherstack_daily.historical_et0(days, latitude, self.elevation, self.plant_type, CANONICAL)
+        self.history.add_history(location, days, et0, CANONICAL)
+        METRICS.inc('backfill_days_total', len(days))
+        LOGGER.info('Backfilled %s %s to %s: %d days, ETo = %.2f mm', location,
+                days[0].date, days[-1].date, len(days), sum([e for e in et0 if e is not None]))
+
 
     commands = {
             'DISCOVER': discover,
             'UPDATE_PROFILE': update_profile,
-            'REMOVE_NOTICES_ALL': remove_notices_all
+            'REMOVE_NOTICES_ALL': remove_notices_all,
+            'BACKFILL': backfill,
             }
 
     # For this node server, all of the info is available in the single
@@ -367,7 +1119,7 @@ class Controller(polyinterface.Controller):
     #       maybe later as an enhancement.
     # TODO: Add forecast data
     drivers = [
-            {'driver': 'ST', 'value': 1, 'uom': 2},   # node server status
+            {'driver': 'ST', 'value': 1, 'uom': 25},  # node server status
             {'driver': 'CLITEMP', 'value': 0, 'uom': 4},   # temperature
             {'driver': 'GV2', 'value': 0, 'uom': 4},       # feelslike temp
             {'driver': 'CLIHUM', 'value': 0, 'uom': 22},   # humidity
@@ -379,8 +1131,29 @@ class Controller(polyinterface.Controller):
             {'driver': 'GV15', 'value': 0, 'uom': 83},     # visability
             {'driver': 'GV6', 'value': 0, 'uom': 24},      # rain
             {'driver': 'GV16', 'value': 0, 'uom': 71},     # UV index
+            {'driver': 'GV7', 'value': 0, 'uom': 106},     # ETo so far today
+            {'driver': 'GV22', 'value': 0, 'uom': 42},     # HTTP latency
+            {'driver': 'GV23', 'value': 0, 'uom': 56},     # errors
+            {'driver': 'GV24', 'value': 0, 'uom': 56},     # requests remaining
+            {'driver': 'GV25', 'value': 0, 'uom': 56},     # driver updates
             ]
 
+
+# Node definitions for the profile, with the driver units for the given
+# unit system.
+def profile_nodes(units):
+    nodes = []
+    for node, name, commands in (
+            (Controller, 'Weather Data', Controller.commands),
+            (weatherstack_location.LocationNode, 'Location', ()),
+            (weatherstack_daily.DailyNode, 'Daily Forecast', ()),
+            (weatherstack_hourly.HourlyNode, 'Hourly Forecast', ()),
+            (weatherstack_balance.WaterBalanceNode, 'Water Balance', weatherstack_balance.WaterBalanceNode.commands)):
+        drivers = copy.deepcopy(node.drivers)
+        weatherstack_units.apply(drivers, units)
+        nodes.append(write_profile.NodeDef(node.id, name, drivers, commands))
+    return nodes
+
     
 if __name__ == "__main__":
     try:
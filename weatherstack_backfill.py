@@ -0,0 +1,196 @@
+# Backfill of past weather from the historical endpoint
+#
+# A new site has no history for the weekly totals and the water balance.
+# The historical endpoint returns up to 60 days per request, so the range
+# is split into chunks and a few of them are fetched at a time, spaced out
+# to the configured request rate.  Each chunk is handed to store() as soon
+# as it arrives (the controller calculates the ETo and writes the days to
+# the history).  The chunks still to do are kept in backfill.json, so a
+# backfill that is interrupted carries on with what's left the next time
+# the node server starts.
+
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CHECKPOINT_FILE = 'backfill.json'
+
+# Most days the historical endpoint returns per request
+CHUNK_DAYS = 60
+
+# Hours between the hourly values requested for each day
+INTERVAL = 3
+
+# Requests per minute and at the same time
+DEFAULT_RATE = 10
+WORKERS = 3
+
+# Give up for now after this many failed requests in a row
+MAX_FAILURES = 3
+
+
+# Split first .. last (datetime.date, inclusive) into (first, last) ISO
+# date strings of at most days days, oldest first
+def chunks(first, last, days=CHUNK_DAYS):
+    result = []
+    while first <= last:
+        end = min(last, first + datetime.timedelta(days=days - 1))
+        result.append((first.isoformat(), end.isoformat()))
+        first = end + datetime.timedelta(days=1)
+    return result
+
+
+# Spaces calls to wait() at least 60 / rate seconds apart
+class RateLimiter(object):
+    def __init__(self, rate):
+        self.interval = 60.0 / max(rate, 0.1)
+        self.lock = threading.Lock()
+        self.next = 0
+
+    # Returns False if stop was set while waiting
+    def wait(self, stop):
+        with self.lock:
+            now = time.time()
+            at = max(now, self.next)
+            self.next = at + self.interval
+        return not stop.wait(at - now)
+
+
+class Backfill(object):
+    # fetch(location, first, last) returns the response or None, and
+    # store(location, response) saves it.
+    def __init__(self, logger, fetch, store, path=CHECKPOINT_FILE):
+        self.logger = logger
+        self.fetch = fetch
+        self.store = store
+        self.path = path
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.rate = DEFAULT_RATE
+        self.workers = WORKERS
+
+        # location: [[first, last], ...] still to do
+        self.pending = {}
+
+    def set_rate(self, rate):
+        try:
+            self.rate = max(0.1, float(rate))
+        except (TypeError, ValueError):
+            self.logger.error('Bad Backfill Rate %s, using %d' % (str(rate), DEFAULT_RATE))
+            self.rate = DEFAULT_RATE
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    # Backfill first .. last (datetime.date) for each location, the most
+    # recent days first.  Anything left from an earlier backfill is
+    # replaced.
+    def start(self, locations, first, last):
+        if self.running():
+            self.logger.info('A backfill is already running')
+            return False
+        with self.lock:
+            self.pending = {location: [list(c) for c in reversed(chunks(first, last))] for location in locations}
+            self.save()
+        self.logger.info('Backfilling %s to %s for %s' % (first, last, ', '.join(locations)))
+        return self.run_thread()
+
+    # Carry on with an interrupted backfill, if there is one
+    def resume(self):
+        self.load()
+        if self.remaining() == 0 or self.running():
+            return False
+        self.logger.info('Resuming backfill, %d requests left' % self.remaining())
+        return self.run_thread()
+
+    def remaining(self):
+        with self.lock:
+            return sum([len(c) for c in self.pending.values()])
+
+    def run_thread(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        limiter = RateLimiter(self.rate)
+        failures = [0]
+        start = time.time()
+
+        def work(location, chunk):
+            if failures[0] >= MAX_FAILURES or not limiter.wait(self.stop_event):
+                return
+            jdata = self.fetch(location, chunk[0], chunk[1])
+            if jdata is None:
+                failures[0] += 1
+                return
+            failures[0] = 0
+            try:
+                self.store(location, jdata)
+            except Exception as e:
+                self.logger.error('Failed to store history for %s %s - %s: %s' %
+                        (location, chunk[0], chunk[1], str(e)))
+            self.done(location, chunk)
+
+        with self.lock:
+            work_list = [(location, chunk) for location, pending in self.pending.items() for chunk in pending]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for location, chunk in work_list:
+                executor.submit(work, location, chunk)
+
+        left = self.remaining()
+        if left == 0:
+            self.logger.info('Backfill finished in %d seconds' % (time.time() - start))
+        elif failures[0] >= MAX_FAILURES:
+            self.logger.error('Backfill stopped after %d failed requests, %d requests left' %
+                    (failures[0], left))
+        else:
+            self.logger.info('Backfill stopped, %d requests left' % left)
+
+    def done(self, location, chunk):
+        with self.lock:
+            pending = self.pending.get(location, [])
+            if chunk in pending:
+                pending.remove(chunk)
+            if len(pending) == 0:
+                self.pending.pop(location, None)
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                pending = json.load(f)
+        except FileNotFoundError:
+            pending = {}
+        except (OSError, ValueError) as e:
+            self.logger.warning('Ignoring bad backfill checkpoint %s: %s' % (self.path, str(e)))
+            pending = {}
+        with self.lock:
+            self.pending = pending
+
+    # Called with the lock held
+    def save(self):
+        if len(self.pending) == 0:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.error('Failed to remove backfill checkpoint %s: %s' % (self.path, str(e)))
+            return
+
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.pending, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.logger.error('Failed to save backfill checkpoint %s: %s' % (self.path, str(e)))
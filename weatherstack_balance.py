@@ -0,0 +1,205 @@
+# Node definition for the water balance (irrigation deficit) of a location
+#
+# The soil moisture deficit goes up by the ETo each day and down by the
+# rain that falls.  It's kept as a running total: each observation adds
+# the rain since the previous one and at the start of each day the day's
+# ETo (from the last forecast made for it) is added, so an update is O(1)
+# no matter how much history there is.  The forecast ETo and rain are used
+# to project how many days until the deficit reaches the irrigation
+# threshold.
+#
+# Days are local dates.  The state is saved (see persist) each time it
+# changes, so a restart, and an Irrigated command before it, carry on.
+#
+# Everything is kept in mm and converted for the drivers.
+
+CLOUD = False
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+    CLOUD = True
+
+import datetime
+import time
+import weatherstack_publish
+import weatherstack_units
+
+LOGGER = polyinterface.LOGGER
+
+# Defaults for the irrigation parameters, mm and mm/hour
+IRRIGATION_THRESHOLD = 25.0
+IRRIGATION_RATE = 12.0
+
+# The deficit can't be more than the soil holds
+SOIL_CAPACITY = 100.0
+
+# Rain is only accumulated over gaps between observations up to this long
+MAX_GAP = 3 * 3600
+
+
+def date_of(epoch):
+    return time.strftime('%Y-%m-%d', time.localtime(epoch))
+
+# Epoch time of the local midnight at the start of date
+def day_epoch(date):
+    return time.mktime(time.strptime(date, '%Y-%m-%d'))
+
+def to_date(date):
+    return datetime.date(*map(int, date.split('-')))
+
+# The dates first <= date < end
+def dates(first, end):
+    date, end = to_date(first), to_date(end)
+    result = []
+    while date < end:
+        result.append(date.isoformat())
+        date += datetime.timedelta(days=1)
+    return result
+
+def days_before(date, days):
+    return (to_date(date) - datetime.timedelta(days=days)).isoformat()
+
+def clamp(deficit):
+    return min(max(deficit, 0.0), SOIL_CAPACITY)
+
+
+class WaterBalanceNode(weatherstack_publish.IndexedDrivers, polyinterface.Node):
+    id = 'balance'
+    drivers = [
+            {'driver': 'GV9', 'value': 0, 'uom': 82},      # water deficit
+            {'driver': 'GV21', 'value': 0, 'uom': 10},     # days until irrigation
+            {'driver': 'GV8', 'value': 0, 'uom': 45},      # irrigation runtime
+            ]
+
+    def __init__(self, controller, primary, address, name):
+        super(WaterBalanceNode, self).__init__(controller, primary, address, name)
+        self.threshold = IRRIGATION_THRESHOLD
+        self.rate = IRRIGATION_RATE
+
+        # Deficit at the start of day, rain so far today
+        self.deficit = 0.0
+        self.day = None
+        self.rain = 0.0
+        self.last_observed = None
+        self.last_irrigated = None
+
+        # Called with state() when it changes
+        self.persist = None
+
+        # ETo by date and (ETo, rain) for the forecast days after today
+        self.et0 = {}
+        self.outlook = []
+
+    def set_irrigation(self, threshold, rate):
+        try:
+            self.threshold = float(threshold)
+            self.rate = float(rate)
+        except (TypeError, ValueError):
+            LOGGER.error('Bad irrigation settings: %s, %s' % (str(threshold), str(rate)))
+
+    # Start from the deficit calculated from history and the ETo expected
+    # for today.
+    def seed(self, deficit, et0_today, now=None):
+        if now is None:
+            now = time.time()
+        self.day = date_of(now)
+        self.deficit = clamp(deficit)
+        if et0_today:
+            self.et0[self.day] = et0_today
+
+    def state(self):
+        return (self.day, self.deficit, self.rain, self.last_observed, self.last_irrigated)
+
+    def restore(self, state):
+        self.day, self.deficit, self.rain, self.last_observed, self.last_irrigated = state
+
+    def save(self):
+        if self.persist is not None and self.day is not None:
+            self.persist(self.state())
+
+    # Add an observation, precip is the rain rate in mm
+    def add_observation(self, observed, precip):
+        day = date_of(observed)
+        if self.day is None:
+            self.day = day
+        elif day > self.day:
+            self.rollover(day)
+
+        if self.last_observed is not None and precip is not None and observed > self.last_observed:
+            hours = min(observed - self.last_observed, MAX_GAP) / 3600.0
+            self.rain += precip * hours
+        self.last_observed = observed
+        self.save()
+
+    # Add the ETo for each day up to day, then start day with no rain
+    def rollover(self, day):
+        deficit = self.deficit - self.rain
+        for date in dates(self.day, day):
+            deficit += self.et0.pop(date, 0.0)
+        self.deficit = clamp(deficit)
+        self.day = day
+        self.rain = 0.0
+
+        for old in [d for d in self.et0 if d < day]:
+            del self.et0[old]
+
+    # days are the ForecastDay records for the days after today, in units
+    def set_forecast(self, days, et0, units):
+        precip = weatherstack_units.to_si('precip', units)
+        self.outlook = []
+        for fcast, day_et0 in zip(days, et0):
+            if day_et0 is None:
+                break
+            self.et0[fcast.date] = day_et0
+            rain = 0.0 if fcast.totalprecip is None else precip(fcast.totalprecip)
+            self.outlook.append((day_et0, rain))
+
+    # Today's ETo so far
+    def et0_so_far(self, now):
+        if self.day is None:
+            return 0.0
+        start = day_epoch(self.day)
+        fraction = min(max((now - start) / 86400.0, 0.0), 1.0)
+        return self.et0.get(self.day, 0.0) * fraction
+
+    # The deficit now
+    def current(self, now):
+        return clamp(self.deficit + self.et0_so_far(now) - self.rain)
+
+    def days_until(self, deficit):
+        if deficit >= self.threshold:
+            return 0
+        for day, (et0, rain) in enumerate(self.outlook, 1):
+            deficit = clamp(deficit + et0 - rain)
+            if deficit >= self.threshold:
+                return day
+        return len(self.outlook) + 1
+
+    # Returns the number of drivers updated and skipped
+    def update(self, force=False, now=None):
+        if now is None:
+            now = self.last_observed or time.time()
+        deficit = self.current(now)
+
+        display = deficit if self.units == 'metric' else weatherstack_units.mm2inch(deficit)
+        values = {
+                'GV9': round(display, 2),
+                'GV21': self.days_until(deficit),
+                'GV8': round(deficit / self.rate * 60) if self.rate > 0 else 0,
+                }
+        return self.driver_state.publish(self, values, force)
+
+    # The area was watered, the deficit starts over from here
+    def irrigated(self, command=None):
+        now = self.last_observed or time.time()
+        if self.day is None:
+            self.day = date_of(now)
+        self.deficit = self.rain - self.et0_so_far(now)
+        self.last_irrigated = int(time.time())
+        self.save()
+        self.update(True, now)
+
+    commands = {
+            'IRRIGATED': irrigated,
+            }
@@ -0,0 +1,81 @@
+# Circuit breaker for the API
+#
+# After several queries in a row fail the breaker opens and no requests
+# are made until a timeout passes.  Then a single probe request is let
+# through (half open): if it works the breaker closes again, if not it
+# stays open for twice as long (up to a limit).  While it is open the
+# nodes keep their last values and the controller shows them as stale.
+
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half open'
+
+# Failures in a row that open the breaker
+FAILURE_THRESHOLD = 3
+
+# How long the breaker stays open, seconds
+OPEN_TIMEOUT = 300
+MAX_OPEN_TIMEOUT = 3600
+
+
+class CircuitBreaker(object):
+    def __init__(self, logger, name, threshold=FAILURE_THRESHOLD,
+                 timeout=OPEN_TIMEOUT, max_timeout=MAX_OPEN_TIMEOUT):
+        self.logger = logger
+        self.name = name
+        self.threshold = threshold
+        self.base_timeout = timeout
+        self.max_timeout = max_timeout
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.probing = False
+
+    # Returns True if a request may be made now.  When half open only the
+    # first caller gets to make the probe request.
+    def allow(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self.opened >= self.timeout:
+                self.logger.info('%s circuit half open, trying one request' % self.name)
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                self.logger.info('%s circuit closed, requests are working again' % self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self.timeout = self.base_timeout
+            self.probing = False
+
+    def failure(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.timeout = min(self.max_timeout, self.timeout * 2)
+            elif self.state != CLOSED or self.failures < self.threshold:
+                return
+            self.state = OPEN
+            self.opened = now
+            self.probing = False
+            self.logger.warning('%s circuit open after %d failures, no requests for %d seconds' %
+                    (self.name, self.failures, self.timeout))
+
+    def is_open(self):
+        return self.state != CLOSED
@@ -0,0 +1,103 @@
+# Response cache for the weatherstack.com API
+#
+# Responses are cached by (endpoint, query).  Current conditions are
+# only updated upstream every so often, so the observation_time in the
+# response is used to decide when the next observation is due and the
+# cached response is used until then.  When a new request returns the same
+# observation as before, the caller can skip parsing and publishing it.
+
+import calendar
+import time
+
+# Expected time between upstream observations, in seconds
+OBSERVATION_CADENCE = 600
+
+# Don't wait less than this before asking again when an observation is late
+MIN_TTL = 60
+
+# Forecasts don't include an observation time
+FORECAST_TTL = 1800
+
+
+# Convert weatherstack's observation_time ("12:14 PM", UTC) to an epoch
+# time.  The date isn't included so use the most recent matching time.
+def observation_epoch(jdata, now=None):
+    if now is None:
+        now = time.time()
+    try:
+        obs = time.strptime(jdata['current']['observation_time'], '%I:%M %p')
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    today = time.gmtime(now)
+    epoch = calendar.timegm((today.tm_year, today.tm_mon, today.tm_mday,
+                             obs.tm_hour, obs.tm_min, 0, 0, 0, 0))
+    if epoch > now + MIN_TTL:
+        epoch -= 86400
+    return epoch
+
+
+class CacheEntry(object):
+    __slots__ = ('payload', 'observed', 'expires')
+
+    def __init__(self, payload, observed, expires):
+        self.payload = payload
+        self.observed = observed
+        self.expires = expires
+
+
+class ResponseCache(object):
+    def __init__(self, cadence=OBSERVATION_CADENCE, forecast_ttl=FORECAST_TTL):
+        self.cadence = cadence
+        self.forecast_ttl = forecast_ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.unchanged = 0
+
+    # Return the cached payload if it is still current, otherwise None
+    def get(self, key, now=None):
+        if now is None:
+            now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None and now < entry.expires:
+            self.hits += 1
+            return entry.payload
+        self.misses += 1
+        return None
+
+    # Store a current conditions payload.  Returns False if it holds the
+    # same observation as the one already cached.
+    def put_observation(self, key, payload, now=None):
+        if now is None:
+            now = time.time()
+        observed = observation_epoch(payload, now)
+        if observed is None:
+            ttl = MIN_TTL
+        else:
+            ttl = max(MIN_TTL, observed + self.cadence - now)
+        return self.put(key, payload, observed, now + ttl)
+
+    # Store a forecast payload.  Returns False if it is identical to the
+    # one already cached.
+    def put_forecast(self, key, payload, now=None):
+        if now is None:
+            now = time.time()
+        return self.put(key, payload, payload.get('forecast'), now + self.forecast_ttl)
+
+    def put(self, key, payload, observed, expires):
+        old = self.entries.get(key)
+        self.entries[key] = CacheEntry(payload, observed, expires)
+        if old is not None and observed is not None and old.observed == observed:
+            self.unchanged += 1
+            return False
+        return True
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'unchanged': self.unchanged}
@@ -11,10 +11,87 @@ import json
 import time
 import datetime
 import et3
+import weatherstack_publish
+import weatherstack_units
 
 LOGGER = polyinterface.LOGGER
 
-class DailyNode(polyinterface.Node):
+
+# Fields of a ForecastDay needed to calculate ETo
+ET0_FIELDS = ('mintemp', 'maxtemp', 'avghumidity', 'maxwind', 'time')
+HISTORICAL_ET0_FIELDS = ('mintemp', 'maxtemp', 'minhumidity', 'maxhumidity', 'avgwind', 'time')
+
+# Map a parsed ForecastDay (weatherstack_parse) to driver values, anything
+# missing from the forecast is left out.
+DAY_DRIVERS = [
+        ('CLIHUM', 'avghumidity', lambda v: round(v, 0)),
+        ('GV0', 'maxtemp', None),
+        ('GV1', 'mintemp', None),
+        ('GV13', 'code', None),
+        ('GV16', 'uv', None),
+        ('GV6', 'totalprecip', None),
+        ('GV4', 'maxwind', None),
+        ('GV15', 'avgvis', None),
+        ]
+
+
+# Get the ETo inputs from a day's forecast.
+#
+#  Temp is in degree C and windspeed is in m/s, we may need to
+#  convert these.
+def et0_inputs(fcast, units):
+    temperature = weatherstack_units.to_si('temperature', units)
+    speed = weatherstack_units.to_si('speed', units)
+
+    Tmin = temperature(fcast.mintemp)
+    Tmax = temperature(fcast.maxtemp)
+    Hmin = Hmax = fcast.avghumidity
+    Ws = speed(fcast.maxwind)
+    J = datetime.datetime.fromtimestamp(fcast.time).timetuple().tm_yday
+
+    return Tmax, Tmin, Hmax, Hmin, Ws, J
+
+# Calculate ETo for every day of a forecast in one pass.  Days that are
+# missing any of the inputs get None.
+def forecast_et0(days, latitude, elevation, plant_type, units):
+    result = [None] * len(days)
+    complete = [i for i, fcast in enumerate(days) if fcast.has(*ET0_FIELDS)]
+    if len(complete) == 0:
+        return result
+
+    inputs = zip(*[et0_inputs(days[i], units) for i in complete])
+    Tmax, Tmin, Hmax, Hmin, Ws, J = [list(i) for i in inputs]
+    et0 = et3.evapotranspriation_batch(Tmax, Tmin, None, Ws, float(elevation), Hmax, Hmin, latitude, float(plant_type), J)
+    for i, value in zip(complete, et0):
+        result[i] = value
+    return result
+
+
+# Calculate ETo for every day of a historical range (HistoricalDay
+# records) in one pass.  Unlike a forecast, these have the day's real
+# humidity range and mean wind.  Days that are missing any of the inputs
+# get None.
+def historical_et0(days, latitude, elevation, plant_type, units):
+    result = [None] * len(days)
+    complete = [i for i, day in enumerate(days) if day.has(*HISTORICAL_ET0_FIELDS)]
+    if len(complete) == 0:
+        return result
+
+    temperature = weatherstack_units.to_si('temperature', units)
+    speed = weatherstack_units.to_si('speed', units)
+    Tmax = [temperature(days[i].maxtemp) for i in complete]
+    Tmin = [temperature(days[i].mintemp) for i in complete]
+    Hmax = [days[i].maxhumidity for i in complete]
+    Hmin = [days[i].minhumidity for i in complete]
+    Ws = [speed(days[i].avgwind) for i in complete]
+    J = [datetime.datetime.fromtimestamp(days[i].time).timetuple().tm_yday for i in complete]
+    et0 = et3.evapotranspriation_batch(Tmax, Tmin, None, Ws, float(elevation), Hmax, Hmin, latitude, float(plant_type), J)
+    for i, value in zip(complete, et0):
+        result[i] = value
+    return result
+
+
+class DailyNode(weatherstack_publish.IndexedDrivers, polyinterface.Node):
     id = 'daily'
     drivers = [
             {'driver': 'GV19', 'value': 0, 'uom': 25},     # day of week
@@ -29,80 +106,37 @@ class DailyNode(polyinterface.Node):
             {'driver': 'GV20', 'value': 0, 'uom': 106},    # mm/day
             ]
 
-    def set_units(self, units):
-        try:
-            for driver in self.drivers:
-                if units == 'imperial':
-                    if driver['driver'] == 'BARPRES': driver['uom'] = 117
-                    if driver['driver'] == 'GV0': driver['uom'] = 17
-                    if driver['driver'] == 'GV1': driver['uom'] = 17
-                    if driver['driver'] == 'GV4': driver['uom'] = 48
-                    if driver['driver'] == 'GV6': driver['uom'] = 105
-                    if driver['driver'] == 'GV19': driver['uom'] = 25
-                    if driver['driver'] == 'GV15': driver['uom'] = 116
-                elif units == 'metric':
-                    if driver['driver'] == 'BARPRES': driver['uom'] = 118
-                    if driver['driver'] == 'GV0': driver['uom'] = 4
-                    if driver['driver'] == 'GV1': driver['uom'] = 4
-                    if driver['driver'] == 'GV4': driver['uom'] = 49
-                    if driver['driver'] == 'GV6': driver['uom'] = 82
-                    if driver['driver'] == 'GV19': driver['uom'] = 25
-                    if driver['driver'] == 'GV15': driver['uom'] = 38
-        except:
-            for drv in self.drivers:
-                if units == 'imperial':
-                    if drv == 'BARPRES': self.drivers[drv]['uom'] = 117
-                    if drv == 'GV0': self.drivers[drv]['uom'] = 17
-                    if drv == 'GV1': self.drivers[drv]['uom'] = 17
-                    if drv == 'GV4': self.drivers[drv]['uom'] = 48
-                    if drv == 'GV6': self.drivers[drv]['uom'] = 105
-                    if drv == 'GV19': self.drivers[drv]['uom'] = 25
-                    if drv == 'GV15': self.drivers[drv]['uom'] = 116
-                elif units == 'metric':
-                    if drv == 'BARPRES': self.drivers[drv]['uom'] = 118
-                    if drv == 'GV0': self.drivers[drv]['uom'] = 4
-                    if drv == 'GV1': self.drivers[drv]['uom'] = 4
-                    if drv == 'GV4': self.drivers[drv]['uom'] = 49
-                    if drv == 'GV6': self.drivers[drv]['uom'] = 82
-                    if drv == 'GV19': self.drivers[drv]['uom'] = 25
-                    if drv == 'GV15': self.drivers[drv]['uom'] = 38
-
     def mm2inch(self, mm):
         return mm/25.4
 
-    def update_forecast(self, jdata, latitude, elevation, plant_type, units):
-        epoch = int(jdata['time'])
-        dow = time.strftime("%w", time.gmtime(epoch))
-        LOGGER.info('Day of week = ' + dow)
-        self.setDriver('CLIHUM', round(float(jdata['avghumidity']), 0), True, False)
-        self.setDriver('GV0', float(jdata['maxtemp']), True, False)
-        self.setDriver('GV1', float(jdata['mintemp']), True, False)
-        self.setDriver('GV13', jdata['code'], True, False)
-        self.setDriver('GV16', float(jdata['uv']), True, False)
-        self.setDriver('GV6', float(jdata['totalprecip']), True, False)
-        self.setDriver('GV4', float(jdata['maxwind']), True, False)
-        self.setDriver('GV15', float(jdata['avgvis']), True, False)
-        self.setDriver('GV19', int(dow), True, False)
-
-        # Calculate ETo
-        #  Temp is in degree C and windspeed is in m/s, we may need to
-        #  convert these.
-        Tmin = float(jdata['mintemp'])
-        Tmax = float(jdata['maxtemp'])
-        Hmin = Hmax = float(jdata['avghumidity'])
-        Ws = float(jdata['maxwind'])
-        J = datetime.datetime.fromtimestamp(jdata['time']).timetuple().tm_yday
-
-        if units != 'metric':
-            LOGGER.info('Conversion of temperature/wind speed required')
-            Tmin = et3.FtoC(Tmin)
-            Tmax = et3.FtoC(Tmax)
-            Ws = et3.mph2ms(Ws)
-        else:
-            Ws = et3.kph2ms(Ws)
-
-        et0 = et3.evapotranspriation(Tmax, Tmin, None, Ws, float(elevation), Hmax, Hmin, latitude, float(plant_type), J)
-        self.setDriver('GV20', round(et0, 2), True, False)
-        LOGGER.info("ETo = %f %f" % (et0, self.mm2inch(et0)))
+    # Update the drivers from a parsed ForecastDay.  Returns the number
+    # of drivers updated and skipped.
+    def update_forecast(self, fcast, latitude, elevation, plant_type, units, force=False, et0=None):
+        values = {}
+        for driver, field, convert in DAY_DRIVERS:
+            value = getattr(fcast, field)
+            if value is not None:
+                values[driver] = value if convert is None else convert(value)
+
+        if fcast.time is not None:
+            dow = time.strftime("%w", time.gmtime(fcast.time))
+            LOGGER.info('Day of week = ' + dow)
+            values['GV19'] = int(dow)
+
+        # Calculate ETo, unless it was already calculated for the whole
+        # forecast (see forecast_et0).
+        if et0 is None and fcast.has(*ET0_FIELDS):
+            Tmax, Tmin, Hmax, Hmin, Ws, J = et0_inputs(fcast, units)
+            try:
+                et0 = et3.evapotranspriation(Tmax, Tmin, None, Ws, float(elevation), Hmax, Hmin, latitude, float(plant_type), J)
+            except ValueError:
+                # No sunset hour angle near the poles, see evapotranspriation_batch
+                et0 = None
+        if et0 is not None:
+            values['GV20'] = round(et0, 2)
+            LOGGER.info("ETo = %f %f" % (et0, self.mm2inch(et0)))
 
+        if fcast.missing:
+            LOGGER.warning('Forecast for %s is missing %s' % (fcast.date, ', '.join(fcast.missing)))
 
+        return self.driver_state.publish(self, weatherstack_units.display(values, self.units), force)
@@ -0,0 +1,55 @@
+# Single-flight request deduplication
+#
+# A poll, the ISY's query command and start-up can all ask for the same
+# data at the same time.  Each request is keyed by (endpoint, location)
+# and only the first caller for a key (the leader) makes the HTTP request,
+# anyone asking for the same key before it finishes waits for and shares
+# the leader's response.
+
+import threading
+
+# Longest time a caller will wait for another caller's request
+WAIT_TIMEOUT = 60
+
+
+class Flight(object):
+    __slots__ = ('done', 'result')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    # Returns (flight, leader).  The leader makes the request and must
+    # call finish() with the result, everyone else calls wait().
+    def join(self, key):
+        with self.lock:
+            self.calls += 1
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = Flight()
+            self.flights[key] = flight
+            return flight, True
+
+    def finish(self, key, result):
+        with self.lock:
+            flight = self.flights.pop(key)
+        flight.result = result
+        flight.done.set()
+
+    def wait(self, flight, timeout=WAIT_TIMEOUT):
+        if not flight.done.wait(timeout):
+            return None
+        return flight.result
+
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced}
@@ -0,0 +1,111 @@
+# Forecast days kept by date
+#
+# The forecast is held per location in a ring of parsed days, each slot
+# is the day's date (as a day number) modulo the ring size.  The forecast
+# nodes show the days after the location's today, so at midnight they
+# move along by a day without any data being moved or fetched: yesterday's
+# day 2 is today's day 1.  A new forecast only replaces the days it
+# covers, and a day keeps its ETo unless its ETo inputs changed.
+
+import datetime
+import time
+
+import weatherstack_daily
+import weatherstack_parse
+
+# Days kept, enough for the 8 day forecast plus a few days of slack
+SIZE = 16
+
+# Forecasts are updated upstream a few times a day, so a forecast that
+# still covers the horizon is refreshed after this many seconds
+REFRESH = 4 * 3600
+
+
+def day_number(date):
+    return datetime.date(*map(int, date.split('-'))).toordinal()
+
+
+class ForecastSlot(object):
+    __slots__ = ['number', 'day', 'et0']
+
+    def __init__(self, number, day, et0=None):
+        self.number = number
+        self.day = day
+        self.et0 = et0
+
+
+class ForecastRing(object):
+    def __init__(self, size=SIZE):
+        self.slots = [None] * size
+        self.utc_offset = None
+        self.latitude = None
+        self.fetched = 0
+        self.shown = None
+
+    # The offset in the response gives the location's date, without it
+    # the node server's local date is used.
+    def set_location(self, jdata):
+        self.latitude = float(jdata['location']['lat'])
+        self.utc_offset = weatherstack_parse.utc_offset(jdata)
+
+    # Today's day number at the location
+    def today(self, now=None):
+        if now is None:
+            now = time.time()
+        if self.utc_offset is None:
+            day = datetime.date.fromtimestamp(now)
+        else:
+            day = datetime.datetime.utcfromtimestamp(now + self.utc_offset * 3600).date()
+        return day.toordinal()
+
+    def get(self, number):
+        slot = self.slots[number % len(self.slots)]
+        if slot is None or slot.number != number:
+            return None
+        return slot
+
+    # Store the parsed days, replacing what's there for those dates.
+    # Returns the slots that need their ETo calculated.
+    def put(self, days, fetched=None):
+        changed = []
+        for fcast in days:
+            if fcast.date is None:
+                continue
+            number = day_number(fcast.date)
+            old = self.get(number)
+            slot = ForecastSlot(number, fcast)
+            if old is not None and old.et0 is not None and same_inputs(old.day, fcast):
+                slot.et0 = old.et0
+            else:
+                changed.append(slot)
+            self.slots[number % len(self.slots)] = slot
+        if fetched is not None:
+            self.fetched = fetched
+        return changed
+
+    # ETo has to be calculated again for every day, after an Elevation or
+    # Plant Type change
+    def clear_et0(self):
+        for slot in self.slots:
+            if slot is not None:
+                slot.et0 = None
+
+    # The slots for count days starting with day number first, None for
+    # any day that isn't there
+    def window(self, first, count):
+        return [self.get(number) for number in range(first, first + count)]
+
+    # True when a new forecast is needed for the count days after today
+    def needs_fetch(self, count, now=None):
+        if now is None:
+            now = time.time()
+        if now - self.fetched >= REFRESH:
+            return True
+        return None in self.window(self.today(now) + 1, count)
+
+
+def same_inputs(old, new):
+    for name in weatherstack_daily.ET0_FIELDS:
+        if getattr(old, name) != getattr(new, name):
+            return False
+    return True
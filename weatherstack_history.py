@@ -0,0 +1,308 @@
+# Local history of observations and forecasts
+#
+# Each current conditions observation and each forecast day (with its ETo)
+# is recorded in a small SQLite database so that rolling totals, like the
+# ETo and rainfall over the last week, can be calculated for irrigation
+# control.  Values are stored in metric units no matter which unit system
+# the node server is using.
+#
+# Raw observations are only kept for a couple of days.  As they are added
+# they're also folded into hourly averages, which are kept for longer, and
+# forecast days are kept longest.  The tables are keyed by (location,
+# time) so range queries are an index scan.
+#
+# The water balance of each location is saved here too, so a restart
+# carries on from it instead of starting over from the history.
+
+import calendar
+import sqlite3
+import threading
+import time
+import weatherstack_units
+
+HISTORY_FILE = 'history.db'
+
+# Retention, in days
+RAW_DAYS = 2
+HOURLY_DAYS = 90
+DAILY_DAYS = 730
+
+# How often old rows are removed, seconds
+PRUNE_INTERVAL = 86400
+
+SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS observations (
+            location TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            temperature REAL,
+            humidity REAL,
+            pressure REAL,
+            wind REAL,
+            precip REAL,
+            PRIMARY KEY (location, time)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS hourly (
+            location TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            temperature REAL,
+            mintemp REAL,
+            maxtemp REAL,
+            humidity REAL,
+            precip REAL,
+            PRIMARY KEY (location, hour)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS daily (
+            location TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            mintemp REAL,
+            maxtemp REAL,
+            precip REAL,
+            et0 REAL,
+            PRIMARY KEY (location, day)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS balance (
+            location TEXT NOT NULL PRIMARY KEY,
+            day TEXT NOT NULL,
+            deficit REAL NOT NULL,
+            rain REAL NOT NULL,
+            last_observed INTEGER,
+            irrigated INTEGER)''',
+        ]
+
+TABLES = {
+        'observations': 'time',
+        'hourly': 'hour',
+        'daily': 'day',
+        }
+
+
+def day_start(epoch):
+    return int(epoch) - int(epoch) % 86400
+
+# Daily rows are keyed by the UTC midnight of their date ('YYYY-MM-DD'),
+# whatever the location's time zone
+def date_key(date):
+    return calendar.timegm(time.strptime(date, '%Y-%m-%d'))
+
+
+# Running average of a value that may be missing
+def mean(average, value, samples):
+    if value is None:
+        return average
+    if average is None:
+        return value
+    return average + (value - average) / samples
+
+def extreme(fn, a, b):
+    if a is None or b is None:
+        return b if a is None else a
+    return fn(a, b)
+
+
+class History(object):
+    def __init__(self, logger, path=HISTORY_FILE):
+        self.logger = logger
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        self.last_prune = 0
+
+    def open(self):
+        try:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                self.db.execute(statement)
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.logger.error('Failed to open history %s: %s' % (self.path, str(e)))
+            self.db = None
+        return self.db is not None
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    # Record a parsed Conditions record observed at epoch time observed
+    def add_observation(self, location, observed, conditions, units):
+        if self.db is None or observed is None:
+            return
+        temperature = conditions.CLITEMP
+        if temperature is not None:
+            temperature = weatherstack_units.to_si('temperature', units)(temperature)
+        wind = conditions.GV4
+        if wind is not None:
+            wind = weatherstack_units.to_si('speed', units)(wind)
+        precip = conditions.GV6
+        if precip is not None:
+            precip = weatherstack_units.to_si('precip', units)(precip)
+
+        hour = int(observed) - int(observed) % 3600
+        with self.lock:
+            try:
+                cursor = self.db.execute('INSERT OR IGNORE INTO observations VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (location, int(observed), temperature, conditions.CLIHUM,
+                         conditions.BARPRES, wind, precip))
+                # Restoring the snapshot may replay an observation, it's
+                # only counted in the hourly averages once.
+                if cursor.rowcount == 1:
+                    self.add_hourly(location, hour, temperature, conditions.CLIHUM, precip)
+                self.db.commit()
+            except sqlite3.Error as e:
+                self.logger.error('Failed to record observation: %s' % str(e))
+        self.prune(observed)
+
+    # Fold an observation into the running hourly averages.  Precipitation
+    # is reported as a rate so the hourly average is the amount for the
+    # hour.
+    def add_hourly(self, location, hour, temperature, humidity, precip):
+        row = self.db.execute('SELECT samples, temperature, mintemp, maxtemp, humidity, precip '
+                'FROM hourly WHERE location = ? AND hour = ?', (location, hour)).fetchone()
+        if row is None:
+            row = (1, temperature, temperature, temperature, humidity, precip)
+        else:
+            samples = row[0] + 1
+            row = (samples,
+                    mean(row[1], temperature, samples),
+                    extreme(min, row[2], temperature),
+                    extreme(max, row[3], temperature),
+                    mean(row[4], humidity, samples),
+                    mean(row[5], precip, samples))
+        self.db.execute('INSERT OR REPLACE INTO hourly VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (location, hour) + row)
+
+    # Record the forecast days (ForecastDay records) and their ETo.  A
+    # newer forecast for a day replaces the older one, so once a day has
+    # passed it holds the last forecast made for it.
+    def add_forecast(self, location, days, et0, units):
+        if self.db is None:
+            return
+        temperature = weatherstack_units.to_si('temperature', units)
+        precip = weatherstack_units.to_si('precip', units)
+
+        rows = []
+        for fcast, day_et0 in zip(days, et0):
+            if fcast.time is None:
+                continue
+            rows.append((location, day_start(fcast.time),
+                None if fcast.mintemp is None else temperature(fcast.mintemp),
+                None if fcast.maxtemp is None else temperature(fcast.maxtemp),
+                None if fcast.totalprecip is None else precip(fcast.totalprecip),
+                day_et0))
+        with self.lock:
+            try:
+                self.db.executemany('INSERT OR REPLACE INTO daily VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self.db.commit()
+            except sqlite3.Error as e:
+                self.logger.error('Failed to record forecast: %s' % str(e))
+
+    # Record observed days (HistoricalDay records) from a backfill.  These
+    # replace any forecast for the day, but the hourly rain only fills in
+    # hours that have no observations of their own.
+    def add_history(self, location, days, et0, units):
+        if self.db is None:
+            return
+        temperature = weatherstack_units.to_si('temperature', units)
+        precip = weatherstack_units.to_si('precip', units)
+
+        daily = []
+        hourly = []
+        for day, day_et0 in zip(days, et0):
+            if day.time is None:
+                continue
+            daily.append((location, day_start(day.time),
+                None if day.mintemp is None else temperature(day.mintemp),
+                None if day.maxtemp is None else temperature(day.maxtemp),
+                None if day.totalprecip is None else precip(day.totalprecip),
+                day_et0))
+            for epoch, temp, humidity, rain in day.hours:
+                temp = temperature(temp)
+                hourly.append((location, epoch - epoch % 3600, 1, temp, temp, temp, humidity, precip(rain)))
+        with self.lock:
+            try:
+                self.db.executemany('INSERT OR REPLACE INTO daily VALUES (?, ?, ?, ?, ?, ?)', daily)
+                self.db.executemany('INSERT OR IGNORE INTO hourly VALUES (?, ?, ?, ?, ?, ?, ?, ?)', hourly)
+                self.db.commit()
+            except sqlite3.Error as e:
+                self.logger.error('Failed to record history: %s' % str(e))
+
+    # Rows of table for location with start <= time < end, oldest first
+    def range(self, table, location, start, end):
+        if self.db is None:
+            return []
+        column = TABLES[table]
+        with self.lock:
+            return self.db.execute('SELECT * FROM %s WHERE location = ? AND %s >= ? AND %s < ? ORDER BY %s' %
+                    (table, column, column, column), (location, int(start), int(end))).fetchall()
+
+    # Total ETo (mm) for the days start <= day < end
+    def et0_total(self, location, start, end):
+        return self.total('SELECT sum(et0) FROM daily WHERE location = ? AND day >= ? AND day < ?',
+                location, day_start(start), day_start(end))
+
+    # Total observed rainfall (mm) for start <= time < end
+    def rain_total(self, location, start, end):
+        return self.total('SELECT sum(precip) FROM hourly WHERE location = ? AND hour >= ? AND hour < ?',
+                location, start, end)
+
+    def total(self, query, location, start, end):
+        if self.db is None:
+            return 0.0
+        with self.lock:
+            value = self.db.execute(query, (location, int(start), int(end))).fetchone()[0]
+        return 0.0 if value is None else value
+
+    # ETo expected for the day containing epoch time day
+    def day_et0(self, location, day):
+        return self.et0_total(location, day, day + 86400)
+
+    # ETo and rainfall over the last days full days
+    def rolling(self, location, days=7, now=None):
+        if now is None:
+            now = time.time()
+        end = day_start(now)
+        start = end - days * 86400
+        return self.et0_total(location, start, end), self.rain_total(location, start, end)
+
+    # The water balance state is (day, deficit, rain, last observed, last
+    # irrigated), see WaterBalanceNode.state()
+    def save_balance(self, location, state):
+        if self.db is None:
+            return
+        with self.lock:
+            try:
+                self.db.execute('INSERT OR REPLACE INTO balance VALUES (?, ?, ?, ?, ?, ?)',
+                        (location,) + tuple(state))
+                self.db.commit()
+            except sqlite3.Error as e:
+                self.logger.error('Failed to save water balance: %s' % str(e))
+
+    # Returns the saved state, or None
+    def load_balance(self, location):
+        if self.db is None:
+            return None
+        with self.lock:
+            try:
+                row = self.db.execute('SELECT day, deficit, rain, last_observed, irrigated FROM balance WHERE location = ?',
+                        (location,)).fetchone()
+            except sqlite3.Error as e:
+                self.logger.error('Failed to load water balance: %s' % str(e))
+                return None
+        return row
+
+    # Remove anything past its retention, at most once a day
+    def prune(self, now=None):
+        if now is None:
+            now = time.time()
+        if now - self.last_prune < PRUNE_INTERVAL:
+            return
+        self.last_prune = now
+        with self.lock:
+            try:
+                for table, days in (('observations', RAW_DAYS), ('hourly', HOURLY_DAYS), ('daily', DAILY_DAYS)):
+                    self.db.execute('DELETE FROM %s WHERE %s < ?' % (table, TABLES[table]),
+                            (int(now) - days * 86400,))
+                self.db.commit()
+            except sqlite3.Error as e:
+                self.logger.error('Failed to prune history: %s' % str(e))
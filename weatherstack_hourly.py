@@ -0,0 +1,61 @@
+# Node definition for an hourly forecast node
+#
+# In hourly forecast mode each location gets one of these for each hour of
+# the configured horizon: "+1 hour" is the next hour, and so on.  They're
+# only created once there's forecast data for them.
+
+CLOUD = False
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+    CLOUD = True
+
+import weatherstack_publish
+import weatherstack_units
+
+LOGGER = polyinterface.LOGGER
+
+FORECAST_MODES = ('daily', 'hourly')
+
+# Forecast Hours limits
+MIN_HOURS = 24
+MAX_HOURS = 72
+
+
+class HourlyNode(weatherstack_publish.IndexedDrivers, polyinterface.Node):
+    id = 'hourly'
+    drivers = [
+            {'driver': 'CLITEMP', 'value': 0, 'uom': 4},   # temperature
+            {'driver': 'GV2', 'value': 0, 'uom': 4},       # feelslike temp
+            {'driver': 'CLIHUM', 'value': 0, 'uom': 22},   # humidity
+            {'driver': 'BARPRES', 'value': 0, 'uom': 117}, # pressure
+            {'driver': 'GV4', 'value': 0, 'uom': 49},      # wind speed
+            {'driver': 'WINDDIR', 'value': 0, 'uom': 76},  # direction
+            {'driver': 'GV13', 'value': 0, 'uom': 25},     # conditions
+            {'driver': 'GV14', 'value': 0, 'uom': 22},     # cloud cover
+            {'driver': 'GV6', 'value': 0, 'uom': 82},      # rain
+            {'driver': 'GV18', 'value': 0, 'uom': 22},     # chance of rain
+            {'driver': 'GV16', 'value': 0, 'uom': 71},     # UV index
+            ]
+
+    # Update the drivers from a parsed Hour.  Returns the number of
+    # drivers updated and skipped.
+    def update_hourly(self, hour, force=False):
+        return self.driver_state.publish(self, weatherstack_units.display(hour.values(), self.units), force)
+
+
+# Forecast Hours as an int within the limits
+def forecast_hours(value):
+    try:
+        hours = int(value)
+    except (TypeError, ValueError):
+        LOGGER.error('Bad Forecast Hours %s, using %d' % (str(value), MIN_HOURS))
+        return MIN_HOURS
+    return min(MAX_HOURS, max(MIN_HOURS, hours))
+
+def forecast_mode(value):
+    if value not in FORECAST_MODES:
+        LOGGER.error('Unknown Forecast Mode %s, using daily' % str(value))
+        return 'daily'
+    return value
@@ -0,0 +1,204 @@
+# HTTP transport for the weatherstack.com API
+#
+# All queries share a single pooled, keep-alive session so that each poll
+# reuses an open connection instead of creating a new one.  Every request
+# has a connect and read timeout, so a stalled server can't hang the
+# polling thread, and failed requests are retried a limited number of
+# times with a jittered exponential backoff.
+#
+# Several locations can be fetched at once.  They are grouped into
+# semicolon separated bulk queries (on plans that support them) and the
+# requests are sent concurrently.
+
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from weatherstack_metrics import METRICS
+
+API_URL = 'http://api.weatherstack.com/'
+
+# Timeouts are in seconds
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+RETRIES = 2
+BACKOFF = 0.5
+
+# Status codes that are worth trying again.  429 (too many requests) isn't
+# one of them, the scheduler backs off instead.
+RETRY_STATUS = (500, 502, 503, 504)
+
+TOO_MANY_REQUESTS = 429
+
+# Maximum number of locations in a single bulk query
+BULK_SIZE = 10
+
+# weatherstack error codes
+USAGE_LIMIT_REACHED = 104
+BULK_NOT_SUPPORTED = 604
+
+
+class Transport(object):
+    def __init__(self, logger, base_url=API_URL,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=RETRIES, backoff=BACKOFF, pool_size=4):
+        self.logger = logger
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.last_latency = 0.0
+        self.rate_limited = 0
+        self.bulk = True
+
+        # Gets a copy of every response when recording (weatherstack_replay)
+        self.recorder = None
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+
+        # Retries are handled here rather than by urllib3 so that each
+        # attempt can be timed and logged.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def delay(self, attempt):
+        # Full jitter: a random delay up to the exponential backoff limit
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    # Make a GET request to one of the API endpoints (current, forecast,
+    # etc.) and return the decoded JSON.
+    def get(self, endpoint, params):
+        url = self.base_url + endpoint
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout)
+                self.last_latency = time.time() - start
+                METRICS.observe('http_request_seconds', self.last_latency, endpoint=endpoint)
+                self.logger.debug('%s: HTTP %d in %.3f seconds (attempt %d)',
+                        endpoint, r.status_code, self.last_latency, attempt + 1)
+                if r.status_code == TOO_MANY_REQUESTS:
+                    self.rate_limited = time.time()
+                    METRICS.inc('rate_limited_total', endpoint=endpoint)
+                if r.status_code not in RETRY_STATUS or attempt >= self.retries:
+                    r.raise_for_status()
+                    jdata = r.json()
+                    if self.recorder is not None:
+                        self.recorder.record(endpoint, params, jdata)
+                    return jdata
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.last_latency = time.time() - start
+                METRICS.inc('http_failed_attempts_total', endpoint=endpoint)
+                self.logger.warning('%s: request failed after %.3f seconds (attempt %d): %s' %
+                        (endpoint, self.last_latency, attempt + 1, str(e)))
+                if attempt >= self.retries:
+                    raise
+
+            time.sleep(self.delay(attempt))
+            attempt += 1
+
+    # Fetch the same endpoint for a list of locations.  Returns the
+    # responses in the same order as the locations, None for any that
+    # failed.
+    def get_many(self, endpoint, params, locations):
+        if len(locations) == 1:
+            return [self.get_one(endpoint, params, locations[0])]
+
+        if self.bulk:
+            chunks = [locations[i:i + BULK_SIZE] for i in range(0, len(locations), BULK_SIZE)]
+            responses = []
+            for chunk, jdata in zip(chunks, self.executor.map(
+                    lambda c: self.get_one(endpoint, params, ';'.join(c)), chunks)):
+                if isinstance(jdata, list) and len(jdata) == len(chunk):
+                    # Each location in a bulk response can be an error
+                    responses.extend([self.check(endpoint, location, item) for location, item in zip(chunk, jdata)])
+                elif len(chunk) == 1:
+                    responses.append(jdata)
+                elif bulk_not_supported(jdata):
+                    self.logger.info('Bulk queries not available with this plan, querying each location')
+                    self.bulk = False
+                    break
+                else:
+                    self.logger.error('%s: unexpected bulk response for %s' % (endpoint, ';'.join(chunk)))
+                    responses.extend([None] * len(chunk))
+            else:
+                return responses
+
+        return list(self.executor.map(
+            lambda location: self.get_one(endpoint, params, location), locations))
+
+    # Error responses are returned as None, except when a bulk query isn't
+    # supported so that get_many can fall back to single queries.
+    def get_one(self, endpoint, params, query):
+        query_params = dict(params)
+        query_params['query'] = query
+        try:
+            jdata = self.get(endpoint, query_params)
+        except (requests.RequestException, ValueError) as e:
+            METRICS.inc('errors_total', endpoint=endpoint, type='http')
+            self.logger.error('%s query for %s failed: %s' % (endpoint, query, str(e)))
+            return None
+
+        if bulk_not_supported(jdata) and ';' in query:
+            return jdata
+        return self.check(endpoint, query, jdata)
+
+    # Returns the response, or None if it's an error response
+    def check(self, endpoint, query, jdata):
+        code = error_code(jdata)
+        if code is None:
+            return jdata
+        if code == USAGE_LIMIT_REACHED:
+            self.rate_limited = time.time()
+            METRICS.inc('rate_limited_total', endpoint=endpoint)
+        METRICS.inc('errors_total', endpoint=endpoint, type='api')
+        self.logger.error('%s query for %s failed: %s' % (endpoint, query, jdata['error'].get('info', code)))
+        return None
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+# weatherstack reports errors with HTTP 200 and an error object
+def error_code(jdata):
+    try:
+        return jdata['error']['code']
+    except (KeyError, TypeError):
+        return None
+
+def bulk_not_supported(jdata):
+    return error_code(jdata) == BULK_NOT_SUPPORTED
+
+
+if __name__ == '__main__':
+    # Exercise the transport against a local stand-in for the API
+    import logging
+    import stub_server
+
+    logging.basicConfig(level=logging.DEBUG)
+    log = logging.getLogger('transport')
+
+    server = stub_server.StubServer({
+        'current': {'current': {'temperature': 20}},
+        'slow': {'current': {}},
+        })
+    server.delay['slow'] = 2
+    server.start()
+
+    transport = Transport(log, base_url=server.url, read_timeout=1, retries=1, backoff=0.1)
+    for i in range(5):
+        transport.get('current', {'access_key': 'key', 'query': 'here'})
+    print('5 requests used %d connection(s)' % server.connections())
+
+    try:
+        transport.get('slow', {})
+    except requests.Timeout:
+        print('slow endpoint timed out after %d attempts' % server.hits['slow'])
+
+    transport.close()
+    server.stop()
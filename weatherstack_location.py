@@ -0,0 +1,42 @@
+# Node definition for the current conditions at an additional location
+#
+# The first location's conditions are shown on the controller node, each
+# additional location gets one of these with its own set of forecast nodes.
+
+CLOUD = False
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+    CLOUD = True
+
+import weatherstack_publish
+import weatherstack_units
+
+LOGGER = polyinterface.LOGGER
+
+
+class LocationNode(weatherstack_publish.IndexedDrivers, polyinterface.Node):
+    id = 'location'
+    drivers = [
+            {'driver': 'CLITEMP', 'value': 0, 'uom': 4},   # temperature
+            {'driver': 'GV2', 'value': 0, 'uom': 4},       # feelslike temp
+            {'driver': 'CLIHUM', 'value': 0, 'uom': 22},   # humidity
+            {'driver': 'BARPRES', 'value': 0, 'uom': 117}, # pressure
+            {'driver': 'GV4', 'value': 0, 'uom': 49},      # wind speed
+            {'driver': 'WINDDIR', 'value': 0, 'uom': 76},  # direction
+            {'driver': 'GV13', 'value': 0, 'uom': 25},     # climate conditions
+            {'driver': 'GV14', 'value': 0, 'uom': 22},     # cloud conditions
+            {'driver': 'GV15', 'value': 0, 'uom': 83},     # visability
+            {'driver': 'GV6', 'value': 0, 'uom': 24},      # rain
+            {'driver': 'GV16', 'value': 0, 'uom': 71},     # UV index
+            {'driver': 'GV7', 'value': 0, 'uom': 106},     # ETo so far today
+            ]
+
+    # Update the drivers from a parsed Conditions record and the ETo so
+    # far today.  Returns the number of drivers updated and skipped.
+    def update_conditions(self, conditions, force=False, et0=None):
+        values = weatherstack_units.display(conditions.values(), self.units)
+        if et0 is not None:
+            values['GV7'] = et0
+        return self.driver_state.publish(self, values, force)
@@ -0,0 +1,195 @@
+# Metrics for the poll pipeline
+#
+# Counters, gauges and latency histograms for the HTTP requests, parsing,
+# ETo calculation and driver updates, kept in one registry (METRICS) that
+# any module can record to.  Recording is a dict update under a lock, so
+# it's cheap enough for the hot path.  The controller shows a few of them
+# as drivers, and all of them can be served in the Prometheus text format
+# on localhost.
+
+import collections
+import json
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# Histogram bucket upper bounds, seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Recent samples kept for percentiles
+RECENT = 100
+
+PREFIX = 'weatherstack_'
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=RECENT)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+
+class Timer(object):
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+# Metrics are keyed by (name, ((label, value), ...))
+def metric_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[metric_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+    # Sum of a counter over all of its labels
+    def total(self, name):
+        with self.lock:
+            return sum([v for (n, l), v in self.counters.items() if n == name])
+
+    # Percentile of the recent samples of a histogram, over all labels
+    def percentile(self, name, pct):
+        with self.lock:
+            samples = []
+            for (n, l), histogram in self.histograms.items():
+                if n == name:
+                    samples.extend(histogram.recent)
+        if len(samples) == 0:
+            return 0.0
+        samples.sort()
+        return samples[int(round((len(samples) - 1) * pct / 100.0))]
+
+    # Everything in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self.lock:
+            for kind, table in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(set([n for n, l in table])):
+                    lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+                    for (n, labels), value in sorted(table.items()):
+                        if n == name:
+                            lines.append('%s%s%s %s' % (PREFIX, name, render_labels(labels), value))
+
+            for name in sorted(set([n for n, l in self.histograms])):
+                lines.append('# TYPE %s%s histogram' % (PREFIX, name))
+                for (n, labels), histogram in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    count = 0
+                    for bound, bucket in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        count += bucket
+                        lines.append('%s%s_bucket%s %d' % (PREFIX, name,
+                                render_labels(labels + (('le', str(bound)),)), count))
+                    lines.append('%s%s_sum%s %f' % (PREFIX, name, render_labels(labels), histogram.sum))
+                    lines.append('%s%s_count%s %d' % (PREFIX, name, render_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def render_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(['%s="%s"' % (k, v) for k, v in labels]) + '}'
+
+
+METRICS = Metrics()
+
+
+# Wraps a payload for logging so it's only serialized if the message is
+# actually logged:  LOGGER.debug('%s', LazyJSON(jdata))
+class LazyJSON(object):
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /metrics on localhost:port from a background thread
+class MetricsServer(object):
+    def __init__(self, logger, port, metrics=METRICS):
+        self.logger = logger
+        self.port = port
+        self.metrics = metrics
+        self.server = None
+
+    def start(self):
+        try:
+            self.server = HTTPServer(('127.0.0.1', self.port), MetricsHandler)
+        except OSError as e:
+            self.logger.error('Failed to start metrics server on port %d: %s' % (self.port, str(e)))
+            return False
+        self.server.metrics = self.metrics
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.logger.info('Serving metrics on http://127.0.0.1:%d/metrics' % self.port)
+        return True
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
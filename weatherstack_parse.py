@@ -0,0 +1,296 @@
+# Response parsing
+#
+# The fields used from each response are described by the tables below
+# (where to find the value, which key to use for each unit system and how
+# to convert it).  Each table is compiled once per unit system into a list
+# of getters, and a response is parsed in a single pass into a small
+# record.  A missing or bad field only leaves that one value unset (None)
+# instead of failing the whole update.
+
+import operator
+
+# (name, path, converter)
+#
+# The last element of the path may be a dict of unit system -> key or a
+# tuple of alternative keys (the first one present is used).
+CURRENT_FIELDS = [
+        ('CLITEMP', ('current', 'temperature'), float),
+        ('GV2', ('current', ('feelslike', 'feelslike_c')), float),
+        ('CLIHUM', ('current', 'humidity'), float),
+        ('BARPRES', ('current', 'pressure'), float),
+        ('GV4', ('current', 'wind_speed'), float),
+        ('WINDDIR', ('current', 'wind_degree'), float),
+        ('GV13', ('current', 'weather_code'), float),
+        ('GV14', ('current', 'cloudcover'), float),
+        ('GV15', ('current', 'visibility'), float),
+        ('GV6', ('current', 'precip'), float),
+        ('GV16', ('current', 'uv_index'), float),
+        ('observation_time', ('current', 'observation_time'), str),
+        ]
+
+FORECAST_FIELDS = [
+        ('time', ('date_epoch',), int),
+        ('date', ('date',), str),
+        ('code', ('day', 'condition', 'code'), int),
+        ('avghumidity', ('day', 'avghumidity'), float),
+        ('uv', ('day', 'uv'), float),
+        ('mintemp', ('day', {'metric': 'mintemp_c', 'imperial': 'mintemp_f'}), float),
+        ('maxtemp', ('day', {'metric': 'maxtemp_c', 'imperial': 'maxtemp_f'}), float),
+        ('totalprecip', ('day', {'metric': 'totalprecip_mm', 'imperial': 'totalprecip_in'}), float),
+        ('avgvis', ('day', {'metric': 'avgvis_km', 'imperial': 'avgvis_miles'}), float),
+        ('maxwind', ('day', {'metric': 'maxwind_kph', 'imperial': 'maxwind_mph'}), float),
+        ]
+
+# Each hour of an hourly forecast (forecastday[].hour[]), by driver
+HOURLY_FIELDS = [
+        ('time', ('time_epoch',), int),
+        ('CLITEMP', ({'metric': 'temp_c', 'imperial': 'temp_f'},), float),
+        ('GV2', ({'metric': 'feelslike_c', 'imperial': 'feelslike_f'},), float),
+        ('CLIHUM', ('humidity',), float),
+        ('BARPRES', ({'metric': 'pressure_mb', 'imperial': 'pressure_in'},), float),
+        ('GV4', ({'metric': 'wind_kph', 'imperial': 'wind_mph'},), float),
+        ('WINDDIR', ('wind_degree',), float),
+        ('GV13', ('condition', 'code'), int),
+        ('GV14', ('cloud',), float),
+        ('GV6', ({'metric': 'precip_mm', 'imperial': 'precip_in'},), float),
+        ('GV18', ('chance_of_rain',), float),
+        ('GV16', ('uv',), float),
+        ]
+
+# Each day of a historical response (historical{date: day}) and each of
+# the day's hourly values
+HISTORICAL_FIELDS = [
+        ('time', ('date_epoch',), int),
+        ('date', ('date',), str),
+        ('mintemp', ('mintemp',), float),
+        ('maxtemp', ('maxtemp',), float),
+        ]
+
+HISTORICAL_HOUR_FIELDS = [
+        ('time', ('time',), int),
+        ('temperature', ('temperature',), float),
+        ('humidity', ('humidity',), float),
+        ('wind', ('wind_speed',), float),
+        ('precip', ('precip',), float),
+        ]
+
+FIELDS = {
+        'current': CURRENT_FIELDS,
+        'forecast': FORECAST_FIELDS,
+        'hourly': HOURLY_FIELDS,
+        'historical': HISTORICAL_FIELDS,
+        'historical_hour': HISTORICAL_HOUR_FIELDS,
+        }
+
+# Current conditions fields that are node drivers
+CURRENT_DRIVERS = [f[0] for f in CURRENT_FIELDS if f[0] != 'observation_time']
+HOURLY_DRIVERS = [f[0] for f in HOURLY_FIELDS if f[0] != 'time']
+
+MISSING = (KeyError, IndexError, TypeError, ValueError)
+
+
+def alternatives(keys):
+    def get(data):
+        for key in keys:
+            if key in data:
+                return data[key]
+        raise KeyError(keys[0])
+    return get
+
+
+def compile_path(path, units):
+    steps = []
+    for key in path:
+        if isinstance(key, dict):
+            key = key['metric' if units == 'metric' else 'imperial']
+        if isinstance(key, tuple):
+            steps.append(alternatives(key))
+        else:
+            steps.append(operator.itemgetter(key))
+
+    if len(steps) == 1:
+        return steps[0]
+
+    def get(data):
+        for step in steps:
+            data = step(data)
+        return data
+    return get
+
+
+def compile_fields(fields, units):
+    return [(name, compile_path(path, units), convert) for name, path, convert in fields]
+
+
+class Extractor(object):
+    def __init__(self, fields, units):
+        self.getters = compile_fields(fields, units)
+
+    # Fill in record from data.  Returns the names of any missing fields.
+    def extract(self, data, record):
+        missing = []
+        for name, get, convert in self.getters:
+            try:
+                setattr(record, name, convert(get(data)))
+            except MISSING:
+                missing.append(name)
+        return missing
+
+
+# Records with driver values (current conditions, forecast hours)
+class Record(object):
+    __slots__ = ()
+    drivers = ()
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    # Driver values for everything that was present
+    def values(self):
+        values = {}
+        for driver in self.drivers:
+            value = getattr(self, driver)
+            if value is not None:
+                values[driver] = value
+        return values
+
+
+class Conditions(Record):
+    __slots__ = CURRENT_DRIVERS + ['observation_time', 'missing']
+    drivers = CURRENT_DRIVERS
+
+
+class Hour(Record):
+    __slots__ = HOURLY_DRIVERS + ['time', 'missing']
+    drivers = HOURLY_DRIVERS
+
+
+class ForecastDay(object):
+    __slots__ = [f[0] for f in FORECAST_FIELDS] + ['missing']
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    def has(self, *names):
+        for name in names:
+            if getattr(self, name) is None:
+                return False
+        return True
+
+
+# A day of observed weather.  The humidity range, mean wind and total
+# rain come from the hourly values, hours is a list of (epoch time,
+# temperature, humidity, precip) for each of them.
+class HistoricalDay(object):
+    __slots__ = [f[0] for f in HISTORICAL_FIELDS] + \
+            ['minhumidity', 'maxhumidity', 'avgwind', 'totalprecip', 'hours', 'missing']
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.hours = []
+
+    def has(self, *names):
+        for name in names:
+            if getattr(self, name) is None:
+                return False
+        return True
+
+
+class HistoricalHour(object):
+    __slots__ = [f[0] for f in HISTORICAL_HOUR_FIELDS]
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+# Extractors are built on first use for each unit system
+_extractors = {}
+
+def extractor(kind, units):
+    key = (kind, units)
+    if key not in _extractors:
+        _extractors[key] = Extractor(FIELDS[kind], units)
+    return _extractors[key]
+
+
+# The location's offset from UTC in hours, None if the response doesn't
+# have it
+def utc_offset(jdata):
+    try:
+        return float(jdata['location']['utc_offset'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_current(jdata, units):
+    record = Conditions()
+    record.missing = extractor('current', units).extract(jdata, record)
+    return record
+
+
+# Parse the days first .. first + count - 1 of a forecast response,
+# yielding a ForecastDay for each.
+def parse_forecast(jdata, units, first=0, count=None):
+    ex = extractor('forecast', units)
+    days = jdata['forecast']['forecastday']
+    end = len(days) if count is None else min(len(days), first + count)
+    for index in range(first, end):
+        record = ForecastDay()
+        record.missing = ex.extract(days[index], record)
+        yield record
+
+
+# Parse up to count hours of an hourly forecast, starting with the hour
+# at epoch time start, yielding an Hour for each.  The response is walked
+# once and only as far as needed: days that end before start are skipped
+# without looking at their hours.
+def parse_hourly(jdata, units, start, count):
+    if count <= 0:
+        return
+    ex = extractor('hourly', units)
+    for day in jdata['forecast']['forecastday']:
+        if day.get('date_epoch', start) + 86400 <= start:
+            continue
+        for hour in day.get('hour', ()):
+            if hour.get('time_epoch', start) < start:
+                continue
+            record = Hour()
+            record.missing = ex.extract(hour, record)
+            yield record
+            count -= 1
+            if count == 0:
+                return
+
+
+# Parse the days of a historical response, oldest first, yielding a
+# HistoricalDay for each.  The hourly values are folded into the day as
+# they're read.
+def parse_historical(jdata, units):
+    ex = extractor('historical', units)
+    hour_ex = extractor('historical_hour', units)
+    days = jdata['historical']
+    for date in sorted(days):
+        record = HistoricalDay()
+        record.missing = ex.extract(days[date], record)
+        winds = []
+        precip = None
+        for data in days[date].get('hourly', ()):
+            hour = HistoricalHour()
+            if hour_ex.extract(data, hour):
+                continue
+            record.minhumidity = hour.humidity if record.minhumidity is None else min(record.minhumidity, hour.humidity)
+            record.maxhumidity = hour.humidity if record.maxhumidity is None else max(record.maxhumidity, hour.humidity)
+            winds.append(hour.wind)
+            precip = hour.precip + (precip or 0.0)
+            if record.time is not None:
+                # time is HHMM
+                epoch = record.time + (hour.time // 100) * 3600 + (hour.time % 100) * 60
+                record.hours.append((epoch, hour.temperature, hour.humidity, hour.precip))
+        if len(winds) > 0:
+            record.avgwind = sum(winds) / len(winds)
+        record.totalprecip = precip
+        yield record
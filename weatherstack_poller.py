@@ -0,0 +1,127 @@
+# Non-blocking fetch scheduler
+#
+# API requests run on a small pool of worker threads so that a slow
+# forecast query never holds up the current conditions or the polyinterface
+# callback thread.  Finished requests are handed back through a queue to a
+# single publish thread, so all driver updates still happen in order on one
+# thread.  A poll for something that is already being fetched is dropped,
+# other queries run alongside it (the fetch layer coalesces duplicate HTTP
+# requests).
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from weatherstack_metrics import METRICS
+
+
+class Poller(object):
+    def __init__(self, logger, workers=2):
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.dropped = 0
+
+        # Most recent fetch/publish durations, in seconds, for each kind
+        # of request (current, forecast, ...)
+        self.timings = {}
+
+        self.publisher = threading.Thread(target=self.publish_loop, daemon=True)
+        self.publisher.start()
+
+    # Schedule fetch() on a worker thread and publish(result) on the
+    # publish thread.  If exclusive, returns False if a fetch of this kind
+    # is already in progress.
+    def submit(self, kind, fetch, publish, exclusive=True):
+        with self.lock:
+            if exclusive and kind in self.in_flight:
+                self.dropped += 1
+                self.logger.info('%s query still in progress, skipping this poll' % kind)
+                return False
+            self.in_flight[kind] = self.in_flight.get(kind, 0) + 1
+
+        self.executor.submit(self.run, kind, fetch, publish)
+        return True
+
+    # Run call() on the publish thread, in order with the queued updates
+    def defer(self, call):
+        self.results.put((None, call, None))
+
+    def busy(self, kind):
+        with self.lock:
+            return kind in self.in_flight
+
+    def done(self, kind):
+        with self.lock:
+            self.in_flight[kind] -= 1
+            if self.in_flight[kind] == 0:
+                del self.in_flight[kind]
+
+    def run(self, kind, fetch, publish):
+        start = time.time()
+        try:
+            result = fetch()
+        except Exception as e:
+            self.logger.error('%s query failed: %s' % (kind, str(e)))
+            METRICS.inc('errors_total', endpoint=kind, type='fetch')
+            self.done(kind)
+            return
+
+        self.timing(kind)['fetch'] = time.time() - start
+        METRICS.observe('fetch_seconds', self.timing(kind)['fetch'], kind=kind)
+        if result is None:
+            self.done(kind)
+            return
+
+        self.results.put((kind, publish, result))
+
+    def publish_loop(self):
+        while True:
+            item = self.results.get()
+            if item is None:
+                break
+
+            kind, publish, result = item
+            if kind is None:
+                try:
+                    publish()
+                except Exception as e:
+                    self.logger.error('Deferred update failed: %s' % str(e))
+                continue
+
+            start = time.time()
+            try:
+                publish(result)
+            except Exception as e:
+                self.logger.error('%s update failed: %s' % (kind, str(e)))
+                METRICS.inc('errors_total', endpoint=kind, type='publish')
+            finally:
+                self.done(kind)
+
+            t = self.timing(kind)
+            t['publish'] = time.time() - start
+            METRICS.observe('publish_seconds', t['publish'], kind=kind)
+            self.logger.debug('%s: fetch %.3f seconds, publish %.3f seconds',
+                    kind, t['fetch'], t['publish'])
+
+    def timing(self, kind):
+        if kind not in self.timings:
+            self.timings[kind] = {'fetch': 0.0, 'publish': 0.0}
+        return self.timings[kind]
+
+    # Block until nothing is in flight (or timeout seconds pass)
+    def wait(self, timeout=None):
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            with self.lock:
+                if not self.in_flight:
+                    return True
+            if end is not None and time.time() > end:
+                return False
+            time.sleep(0.01)
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
+        self.results.put(None)
@@ -0,0 +1,130 @@
+# Change detection for node drivers
+#
+# Each node keeps the last value sent for each of its drivers.  New values
+# are rounded to the driver's precision and compared against those, and
+# only the drivers that actually changed are sent on to Polyglot/ISY.
+#
+# Nodes also get their own copy of their class's driver table (see
+# IndexedDrivers) so a driver can be looked up by name instead of
+# scanning the list.
+
+import copy
+import weatherstack_units
+from weatherstack_metrics import METRICS
+
+# Number of decimal places that matter for each driver, anything not
+# listed here uses DEFAULT_PRECISION.
+PRECISION = {
+        'ST': 0,
+        'CLITEMP': 1,
+        'GV0': 1,
+        'GV1': 1,
+        'GV2': 1,
+        'CLIHUM': 0,
+        'BARPRES': 2,
+        'GV4': 1,
+        'WINDDIR': 0,
+        'GV6': 2,
+        'GV7': 2,
+        'GV13': 0,
+        'GV14': 0,
+        'GV15': 1,
+        'GV16': 1,
+        'GV19': 0,
+        'GV20': 2,
+        'GV22': 0,
+        }
+DEFAULT_PRECISION = 2
+
+
+def normalize(driver, value):
+    if isinstance(value, float):
+        places = PRECISION.get(driver, DEFAULT_PRECISION)
+        value = round(value, places)
+        if places == 0:
+            value = int(value)
+    return value
+
+
+class DriverState(object):
+    def __init__(self):
+        self.last = {}
+        self.sent = 0
+        self.skipped = 0
+
+    # Return the (driver, value) pairs that differ from what was last sent
+    def changes(self, values, force=False):
+        delta = []
+        for driver, value in values.items():
+            value = normalize(driver, value)
+            if force or self.last.get(driver) != value:
+                delta.append((driver, value))
+        return delta
+
+    # Send the changed values to the node in one pass.  Returns the number
+    # of drivers sent and skipped.
+    def publish(self, node, values, force=False):
+        delta = self.changes(values, force)
+        for driver, value in delta:
+            node.setDriver(driver, value, True, force)
+            self.last[driver] = value
+
+        sent = len(delta)
+        skipped = len(values) - sent
+        self.sent += sent
+        self.skipped += skipped
+        METRICS.inc('driver_updates_total', sent)
+        METRICS.inc('driver_updates_skipped_total', skipped)
+        return sent, skipped
+
+    # Forget what was sent, e.g. after the driver units change
+    def reset(self):
+        self.last = {}
+
+
+# Mixin for nodes: after the node is set up, init_drivers() replaces the
+# class's list of driver dicts with a copy for this node and indexes it by
+# driver name.  Changing one node's units then doesn't change every node of
+# its class, and setDriver/getDriver don't have to scan the list.  The list
+# is still what Polyglot sees, the index just points at its entries.  Each
+# node also gets its own DriverState and units.
+class IndexedDrivers(object):
+    driver_index = None
+
+    def __init__(self, *args, **kwargs):
+        super(IndexedDrivers, self).__init__(*args, **kwargs)
+        self.init_drivers()
+        self.driver_state = DriverState()
+        self.units = 'imperial'
+
+    def set_units(self, units):
+        self.units = units
+        weatherstack_units.apply(self.drivers, units)
+
+        # Values need to be resent with the new units
+        self.driver_state.reset()
+
+    def init_drivers(self):
+        self.drivers = copy.deepcopy(self.drivers)
+        if isinstance(self.drivers, list):
+            self.driver_index = {d['driver']: d for d in self.drivers}
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        if self.driver_index is None:
+            return super(IndexedDrivers, self).setDriver(driver, value, report, force, uom)
+        d = self.driver_index.get(driver)
+        if d is None:
+            return
+        d['value'] = value
+        if uom is not None:
+            d['uom'] = uom
+        if report:
+            self.reportDriver(d, report, force)
+
+    def getDriver(self, driver):
+        if self.driver_index is None:
+            return super(IndexedDrivers, self).getDriver(driver)
+        d = self.driver_index.get(driver)
+        if d is None:
+            return None
+        return d['value']
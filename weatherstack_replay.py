@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Record and replay weatherstack.com API traffic
+
+With the Record Directory parameter set, the node server saves every API
+response it receives (without the access key) to that directory, one
+numbered JSON file per request.
+
+Run this file to replay a recording through the controller, forecast and
+water balance nodes, using the in-memory polyinterface (polystub) and a
+local stand-in for the API (stub_server).  Each recorded response is
+served in order and the matching query goes through the normal
+fetch -> parse -> publish path.  The time between responses is divided by
+--speed, use --speed 0 to go as fast as possible.
+
+Responses are always metric, the Units the node server was configured
+with are recorded with each response and the replay publishes in those,
+or in --units.
+
+    python3 weatherstack_replay.py recording/ [--speed 1000] [--loops 10] [--units imperial]
+"""
+
+import json
+import os
+import threading
+import time
+
+RECORD_FORMAT = '%06d-%s.json'
+
+
+class Recorder(object):
+    def __init__(self, logger, directory):
+        self.logger = logger
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.seq = 0
+        # The configured Units, set by the controller
+        self.units = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self.seq = len(list_recording(directory))
+        except OSError as e:
+            self.logger.error('Failed to create record directory %s: %s' % (directory, str(e)))
+
+    def record(self, endpoint, params, payload):
+        params = {k: v for k, v in params.items() if k != 'access_key'}
+        entry = {'time': time.time(), 'endpoint': endpoint, 'params': params, 'response': payload}
+        if self.units is not None:
+            entry['units'] = self.units
+        with self.lock:
+            self.seq += 1
+            path = os.path.join(self.directory, RECORD_FORMAT % (self.seq, endpoint))
+            try:
+                with open(path, 'w') as f:
+                    json.dump(entry, f)
+            except OSError as e:
+                self.logger.error('Failed to record %s: %s' % (path, str(e)))
+
+
+def list_recording(directory):
+    return sorted([name for name in os.listdir(directory) if name.endswith('.json')])
+
+
+def load_recording(directory):
+    entries = []
+    for name in list_recording(directory):
+        with open(os.path.join(directory, name), 'r') as f:
+            entries.append(json.load(f))
+    return entries
+
+
+# Locations in the order they first appear, and the unit system.  Older
+# recordings don't have the configured Units, for those it's the units
+# that were requested.
+def recorded_setup(entries):
+    locations = []
+    units = None
+    requested = 'imperial'
+    for entry in entries:
+        for location in entry['params'].get('query', '').split(';'):
+            if location != '' and location not in locations:
+                locations.append(location)
+        if units is None and 'units' in entry:
+            units = entry['units']
+        if entry['endpoint'] == 'current' and 'units' in entry['params']:
+            requested = 'metric' if entry['params']['units'] == 'm' else 'imperial'
+    return locations, units or requested
+
+
+# Serves the most recently replayed response for each (endpoint, location)
+class Responder(object):
+    def __init__(self):
+        self.current = {}
+
+    def set(self, entry):
+        queries = entry['params'].get('query', '').split(';')
+        responses = entry['response']
+        if not isinstance(responses, list) or len(queries) == 1:
+            responses = [responses]
+        for query, response in zip(queries, responses):
+            self.current[(entry['endpoint'], query)] = response
+
+    def endpoint(self, endpoint):
+        def respond(params):
+            responses = [self.current.get((endpoint, query))
+                         for query in params.get('query', '').split(';')]
+            if len(responses) > 1:
+                return responses
+            return responses[0]
+        return respond
+
+
+def main():
+    import polystub
+    polystub.install()
+
+    import argparse
+    import logging
+    import tempfile
+    import stub_server
+    import weatherstack
+    import write_profile
+    from weatherstack_metrics import METRICS
+
+    parser = argparse.ArgumentParser(description='Replay recorded weatherstack responses')
+    parser.add_argument('directory', help='directory of recorded responses')
+    parser.add_argument('--speed', type=float, default=1000.0,
+            help='time acceleration, 0 for as fast as possible')
+    parser.add_argument('--loops', type=int, default=1, help='number of times to replay the recording')
+    parser.add_argument('--units', choices=['imperial', 'metric'], help='publish in these units instead of the recorded ones')
+    parser.add_argument('--debug', action='store_true', help='enable debug logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    entries = load_recording(args.directory)
+    if len(entries) == 0:
+        print('No recorded responses in %s' % args.directory)
+        return
+    locations, units = recorded_setup(entries)
+    if args.units is not None:
+        units = args.units
+
+    responder = Responder()
+    server = stub_server.StubServer({
+        'current': responder.endpoint('current'),
+        'forecast': responder.endpoint('forecast'),
+        })
+    server.start()
+
+    poly = polystub.Interface('WeatherStack', {
+        'Location': ';'.join(locations),
+        'APIkey': 'replay',
+        'Units': units,
+        })
+    control = weatherstack.Controller(poly)
+    control.transport.base_url = server.url
+    control.transport.backoff = 0
+    state = tempfile.mkdtemp()
+    control.snapshot.path = os.path.join(state, 'snapshot.json')
+    control.scheduler.path = os.path.join(state, 'schedule.json')
+    control.history.path = os.path.join(state, 'history.db')
+    # The profile for the recorded units goes there too, not into profile/
+    control.profile_dir = os.path.join(state, 'profile')
+    for path in (write_profile.NODEDEF_FILE, write_profile.EDITOR_FILE, write_profile.NLS_FILE):
+        os.makedirs(os.path.dirname(os.path.join(control.profile_dir, path)), exist_ok=True)
+    control.check_params()
+    control.started = True
+    control.history.open()
+    control.discover()
+
+    queries = {
+            'current': control.query_conditions,
+            'forecast': control.query_forecast,
+            }
+
+    start = time.time()
+    replayed = 0
+    for loop in range(args.loops):
+        previous = None
+        for entry in entries:
+            if entry['endpoint'] not in queries:
+                continue
+            if args.speed > 0 and previous is not None:
+                gap = (entry['time'] - previous) / args.speed
+                if gap > 0:
+                    time.sleep(gap)
+            previous = entry['time']
+
+            # Polls would skip the request while the cached response is
+            # current, the replay decides when there's a new one.
+            responder.set(entry)
+            control.clock = lambda: entry['time']
+            for location in entry['params'].get('query', '').split(';'):
+                control.cache.invalidate((entry['endpoint'], location))
+            queries[entry['endpoint']](False)
+            control.poller.wait()
+            replayed += 1
+    elapsed = time.time() - start
+
+    print('%d responses replayed for %s (%s) in %.2f seconds, %.1f per second' %
+            (replayed, ';'.join(locations), units, elapsed, replayed / elapsed))
+    print('driver updates sent: %d, nodes: %d' % (poly.sent, len(control.nodes)))
+    for name in ('fetch_seconds', 'publish_seconds', 'parse_seconds', 'et0_seconds'):
+        print('%-16s p50 %8.3f ms   p99 %8.3f ms' % (name,
+                METRICS.percentile(name, 50) * 1000, METRICS.percentile(name, 99) * 1000))
+
+    control.stop()
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+# Adaptive poll scheduling
+#
+# shortPoll and longPoll fire at fixed intervals, this decides whether a
+# poll should actually query the API.  Current conditions are queried when
+# the next upstream observation is expected, based on the observed
+# interval between observation times and how long after its observation
+# time an observation shows up in the API.  After errors the queries back off
+# exponentially (a lot more when the API reports we're over the limit),
+# and if a monthly quota is configured the requests left are spread evenly
+# over what's left of the billing period.
+
+import calendar
+import json
+import os
+import random
+import threading
+import time
+
+# Limits on the learned observation interval, seconds
+MIN_CADENCE = 60
+MAX_CADENCE = 3600
+
+# Weight given to each new observation interval
+CADENCE_WEIGHT = 0.3
+
+# Wait this long past the expected observation before asking
+OBSERVATION_MARGIN = 30
+
+# Retry this soon when an observation is late, doubling each time it
+# still isn't there, up to the cadence
+LATE_RETRY = 60
+
+# weatherstack's observation times often lag by more than the cadence.
+# The lag is learned from when new observations are first seen: when an
+# observation needed retries it's the time since the observation, when it
+# was already there the lag is shortened by this much so it doesn't stay
+# too long.
+LAG_STEP = 30
+MAX_LAG = 4 * 3600
+
+# Backoff after errors, seconds
+BACKOFF_BASE = 60
+BACKOFF_MAX = 3600
+RATE_LIMITED_BACKOFF = 4 * 3600
+
+# How often the forecast is queried when there's no quota pressure
+FORECAST_INTERVAL = 1800
+
+STATE_FILE = 'schedule.json'
+
+
+# Start of the billing period that contains now.  The period starts at
+# midnight UTC on billing_day of each month.
+def period_start(now, billing_day):
+    t = time.gmtime(now)
+    year, month = t.tm_year, t.tm_mon
+    if t.tm_mday < billing_day:
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    day = min(billing_day, calendar.monthrange(year, month)[1])
+    return calendar.timegm((year, month, day, 0, 0, 0, 0, 0, 0))
+
+def period_end(start, billing_day):
+    t = time.gmtime(start)
+    year, month = t.tm_year, t.tm_mon + 1
+    if month == 13:
+        year, month = year + 1, 1
+    day = min(billing_day, calendar.monthrange(year, month)[1])
+    return calendar.timegm((year, month, day, 0, 0, 0, 0, 0, 0))
+
+
+class Scheduler(object):
+    def __init__(self, logger, path=STATE_FILE):
+        self.logger = logger
+        self.path = path
+        self.cadence = MIN_CADENCE * 10
+        self.last_observed = None
+        self.lag = 0
+        # Queries in a row that didn't find the next observation yet
+        self.late = 0
+        self.next_time = {'current': 0, 'forecast': 0}
+        self.errors = {'current': 0, 'forecast': 0}
+
+        # API requests used by the last query of each kind
+        self.cost = {'current': 1, 'forecast': 1}
+
+        self.quota = 0
+        self.billing_day = 1
+        self.period = 0
+        self.used = 0
+
+        # The current conditions and forecast queries run on different
+        # threads
+        self.lock = threading.Lock()
+
+    def set_quota(self, quota, billing_day):
+        try:
+            self.quota = max(0, int(quota))
+            self.billing_day = min(28, max(1, int(billing_day)))
+        except (TypeError, ValueError):
+            self.logger.error('Bad quota settings: %s, %s' % (str(quota), str(billing_day)))
+
+    def due(self, kind, now=None):
+        if now is None:
+            now = time.time()
+        return now >= self.next_time[kind]
+
+    def remaining(self, now=None):
+        if self.quota == 0:
+            return None
+        self.roll_period(now)
+        return max(0, self.quota - self.used)
+
+    def roll_period(self, now=None):
+        if now is None:
+            now = time.time()
+        start = period_start(now, self.billing_day)
+        if start != self.period:
+            self.period = start
+            self.used = 0
+
+    # Minimum time between queries of kind that the quota allows
+    def quota_interval(self, kind, now):
+        if self.quota == 0:
+            return 0
+        self.roll_period(now)
+        left = self.quota - self.used
+        seconds = period_end(self.period, self.billing_day) - now
+        if left <= 0:
+            return seconds
+
+        # The forecast gets what it needs at its normal rate, up to half of
+        # the budget, and current conditions get the rest.
+        rate = float(left) / seconds
+        forecast_rate = min(rate / 2, float(self.cost['forecast']) / FORECAST_INTERVAL)
+        if kind == 'forecast':
+            return self.cost['forecast'] / forecast_rate
+        return self.cost['current'] / (rate - forecast_rate)
+
+    # A query of kind used requests API requests (one per location) and
+    # returned data.  observed is the epoch time of the observation for
+    # current conditions.
+    def success(self, kind, requests, observed=None, now=None):
+        if now is None:
+            now = time.time()
+        self.errors[kind] = 0
+        self.count(kind, requests, now)
+
+        if kind == 'current':
+            if observed is not None:
+                if self.last_observed is not None and observed > self.last_observed:
+                    self.learn_lag(observed, now)
+                self.learn(observed)
+            if self.last_observed is not None:
+                interval = self.last_observed + self.cadence + self.lag + OBSERVATION_MARGIN - now
+                if interval <= 0:
+                    interval = min(self.cadence, LATE_RETRY * (2 ** self.late))
+                    self.late += 1
+            else:
+                interval = self.cadence
+        else:
+            interval = FORECAST_INTERVAL
+
+        self.schedule(kind, max(interval, self.quota_interval(kind, now)), now)
+
+    def failure(self, kind, requests, rate_limited=False, now=None):
+        if now is None:
+            now = time.time()
+        self.errors[kind] += 1
+        self.count(kind, requests, now)
+
+        if rate_limited:
+            delay = RATE_LIMITED_BACKOFF
+        else:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (self.errors[kind] - 1)))
+            delay = random.uniform(delay / 2, delay)
+        self.logger.warning('%s query failed %d time(s)%s, next try in %d seconds' %
+                (kind, self.errors[kind], ' (rate limited)' if rate_limited else '', delay))
+        self.schedule(kind, delay, now)
+
+    def learn(self, observed):
+        if self.last_observed is not None and observed > self.last_observed:
+            interval = min(MAX_CADENCE, max(MIN_CADENCE, observed - self.last_observed))
+            self.cadence = (1 - CADENCE_WEIGHT) * self.cadence + CADENCE_WEIGHT * interval
+            self.logger.debug('Observation interval %d seconds, cadence now %d', interval, self.cadence)
+        if self.last_observed is None or observed > self.last_observed:
+            self.last_observed = observed
+
+    def learn_lag(self, observed, now):
+        if self.late > 0:
+            self.lag = min(MAX_LAG, max(0, now - observed))
+        else:
+            self.lag = max(0, self.lag - LAG_STEP)
+        self.late = 0
+        self.logger.debug('Observations show up %d seconds after their time', self.lag)
+
+    def schedule(self, kind, interval, now):
+        self.next_time[kind] = now + interval
+        self.logger.debug('Next %s query in %d seconds', kind, interval)
+
+    def count(self, kind, requests, now):
+        with self.lock:
+            self.roll_period(now)
+            self.cost[kind] = max(1, requests)
+            self.used += requests
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+            self.period = state['period']
+            self.used = state['used']
+            self.cadence = state.get('cadence', self.cadence)
+            self.lag = state.get('lag', self.lag)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning('Ignoring bad schedule state %s: %s' % (self.path, str(e)))
+
+    def save(self):
+        state = {'period': self.period, 'used': self.used, 'cadence': self.cadence, 'lag': self.lag}
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.logger.error('Failed to save schedule state: %s' % str(e))
@@ -0,0 +1,78 @@
+# Snapshot of the last good API responses
+#
+# The most recent current conditions and forecast are written to a small
+# local file so that after a restart the nodes can be filled in right away,
+# before (or without) any network access.  The file is replaced atomically
+# so a crash mid-write never leaves a partial snapshot behind.  Responses
+# are added with put() and written once per poll with flush().
+
+import json
+import os
+import tempfile
+import threading
+
+SNAPSHOT_FILE = 'snapshot.json'
+
+# Only the parts of each response that are used are saved
+KEEP = {
+        'current': ('location', 'current'),
+        'forecast': ('location', 'forecast'),
+        }
+
+
+class Snapshot(object):
+    def __init__(self, logger, path=SNAPSHOT_FILE):
+        self.logger = logger
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {}
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            self.data = {}
+        except (OSError, ValueError) as e:
+            self.logger.warning('Ignoring unreadable snapshot %s: %s' % (self.path, str(e)))
+            self.data = {}
+        return self.data
+
+    # Return the saved payload for kind and location if it was saved
+    # with the given units, otherwise None.
+    def get(self, kind, location, units):
+        entry = self.data.get(kind, {}).get(location)
+        if entry is None or entry.get('units') != units:
+            return None
+        return entry['payload']
+
+    def put(self, kind, location, payload, units):
+        compact = {k: payload[k] for k in KEEP[kind] if k in payload}
+        with self.lock:
+            self.data.setdefault(kind, {})[location] = {'units': units, 'payload': compact}
+            self.dirty = True
+
+    # Write the file if anything was added since the last write
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            self.write()
+
+    def write(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.data, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.logger.error('Failed to write snapshot %s: %s' % (self.path, str(e)))
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
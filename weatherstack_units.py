@@ -0,0 +1,130 @@
+# Unit systems
+#
+# One table of driver -> uom for each unit system, used to set the driver
+# units on every node, and one table of converters from each unit system
+# to the SI units used by the ETo calculation.  Supporting another unit
+# system or driver is a matter of adding entries here.
+#
+# Responses are always requested, parsed and stored in metric (CANONICAL)
+# and only converted to the configured unit system when the drivers are
+# published, so a Units change doesn't need new data.
+#
+# The converters are plain arithmetic so they work the same on single
+# values and on numpy arrays.
+
+import et3
+
+UNIT_SYSTEMS = ('metric', 'imperial')
+CANONICAL = 'metric'
+
+# driver: (metric uom, imperial uom)
+DRIVER_UOM = {
+        'CLITEMP': (4, 17),    # temperature
+        'DEWPT': (4, 17),      # dew point
+        'GV0': (4, 17),        # high temperature
+        'GV1': (4, 17),        # low temperature
+        'GV2': (4, 17),        # feels like
+        'GV3': (4, 17),        # average temperature
+        'BARPRES': (117, 23),  # pressure
+        'GV4': (49, 48),       # wind speed
+        'GV5': (49, 48),       # gust speed
+        'GV6': (82, 105),      # rain
+        'GV15': (38, 116),     # visibility
+        'GV9': (82, 105),      # water deficit
+        }
+
+# Precomputed per unit system: {units: {driver: uom}}
+UOM = {}
+for _index, _units in enumerate(UNIT_SYSTEMS):
+    UOM[_units] = {driver: uoms[_index] for driver, uoms in DRIVER_UOM.items()}
+
+
+def uom_table(units):
+    return UOM.get(units, UOM['imperial'])
+
+
+# Set the uom of each driver for the unit system.  Works with both the
+# list of driver dicts (polyinterface) and the dict of drivers
+# (pgc_interface).
+def apply(drivers, units):
+    table = uom_table(units)
+    if isinstance(drivers, dict):
+        for name, driver in drivers.items():
+            uom = table.get(name)
+            if uom is not None:
+                driver['uom'] = uom
+        return
+
+    for driver in drivers:
+        uom = table.get(driver['driver'])
+        if uom is not None:
+            driver['uom'] = uom
+
+
+def _same(value):
+    return value
+
+def inch2mm(inch):
+    return inch * 25.4
+
+def mm2inch(mm):
+    return mm / 25.4
+
+def mile2km(mile):
+    return mile * 1.609344
+
+def km2mile(km):
+    return km / 1.609344
+
+def c2f(c):
+    return c * 1.8 + 32
+
+def kph2mph(kph):
+    return kph / 1.609344
+
+def mb2inhg(mb):
+    return mb * 0.0295300
+
+# quantity: {units: converter to SI}
+TO_SI = {
+        'temperature': {'metric': _same, 'imperial': et3.FtoC},       # C
+        'speed': {'metric': et3.kph2ms, 'imperial': et3.mph2ms},      # m/s
+        'precip': {'metric': _same, 'imperial': inch2mm},             # mm
+        'distance': {'metric': _same, 'imperial': mile2km},           # km
+        }
+
+
+def to_si(quantity, units):
+    converters = TO_SI[quantity]
+    return converters.get(units, converters['imperial'])
+
+
+# units: {driver: converter from the canonical value}
+FROM_CANONICAL = {
+        'metric': {},
+        'imperial': {
+            'CLITEMP': c2f,
+            'DEWPT': c2f,
+            'GV0': c2f,
+            'GV1': c2f,
+            'GV2': c2f,
+            'GV3': c2f,
+            'BARPRES': mb2inhg,
+            'GV4': kph2mph,
+            'GV5': kph2mph,
+            'GV6': mm2inch,
+            'GV15': km2mile,
+            },
+        }
+
+
+# Convert a dict of canonical driver values for display in units
+def display(values, units):
+    converters = FROM_CANONICAL.get(units, FROM_CANONICAL['imperial'])
+    if len(converters) == 0:
+        return values
+    shown = {}
+    for driver, value in values.items():
+        convert = converters.get(driver)
+        shown[driver] = value if convert is None else convert(value)
+    return shown
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Build the node server profile (node definitions, editors and NLS) from the
+node driver definitions.
+
+The rendered files are compared with the files in profile/, only the files
+that differ are rewritten (and the profile needs to be reinstalled on the
+ISY) when something changed.
+
+Run this directly to check the files in profile/ against what the current
+driver definitions produce, or with --write to update them.
+"""
+
+import os
+
+PROFILE_DIR = 'profile'
+
+NODEDEF_FILE = os.path.join('nodedef', 'nodedef.xml')
+EDITOR_FILE = os.path.join('editor', 'editors.xml')
+NLS_FILE = os.path.join('nls', 'en_us.txt')
+
+# Editor definitions (id, range attributes)
+EDITORS = [
+        ('bool', 'uom="2" subset="0,1"'),
+        ('int', 'uom="56" min="0" max="150" step="1" prec="1"'),
+        ('TEMP_F', 'uom="17" min="-50" max="150" step="1" prec="1"'),
+        ('PERCENT', 'uom="22" min="0" max="100" prec="0"'),
+        ('PRESSURE', 'uom="23" min="0" max="100" prec="3"'),
+        ('LUMIN', 'uom="36" min="0" max="200000" prec="0"'),
+        ('MPH', 'uom="48" min="0" max="500" prec="0"'),
+        ('MPS', 'uom="49" min="0" max="500" prec="0"'),
+        ('DEGREES', 'uom="76" min="0" max="360" prec="0"'),
+        ('INCHES', 'uom="105" min="0" max="20000" prec="3"'),
+        ('inhr', 'uom="24" min="0" max="2000" prec="3"'),
+        ('METERS', 'uom="38" min="0" max="200000" prec="0"'),
+        ('COVERAGE', 'uom="27" min="0" max="200000" prec="0"'),
+        ('CONDITIONS', 'uom="25" subset="1000,1282" nls="EN_DAY_CONDITION"'),
+        ('INTENSITY', 'uom="70" min="0" max="100" prec="0"'),
+        ('INHG', 'uom="23" min="0" max="100" prec="0"'),
+        ('MB', 'uom="117" min="1000" max="2000" prec="0"'),
+        ('HPA', 'uom="118" min="1000" max="2000" prec="0"'),
+        ('UV', 'uom="71" min="0" max="15" prec="1"'),
+        ('OZONE', 'uom="56" min="0" max="500" prec="2"'),
+        ('MILES', 'uom="116" min="0" max="500" prec="2"'),
+        ('DAY', 'uom="25" min="0" max="6" nls="EN_DAY"'),
+        ('STATUS', 'uom="25" subset="0-2" nls="EN_STATUS"'),
+        ('ET', 'uom="106" min="0" max="100"  prec="2"'),
+        ('KM', 'uom="83"  min="0" max="10000" prec="1"'),
+        ('TEMP_C', 'uom="4" min="-50" max="70" step="1" prec="1"'),
+        ('MM', 'uom="82" min="0" max="500000" prec="2"'),
+        ('DAYS', 'uom="10" min="0" max="30" prec="0"'),
+        ('MINUTES', 'uom="45" min="0" max="1440" prec="0"'),
+        ('MSEC', 'uom="42" min="0" max="100000" prec="0"'),
+        ('COUNT', 'uom="56" min="0" max="1000000000" prec="0"'),
+        ]
+
+# Editor to use for each uom
+UOM_EDITOR = {
+        2: 'bool',
+        4: 'TEMP_C',
+        10: 'DAYS',
+        17: 'TEMP_F',
+        22: 'PERCENT',
+        23: 'INHG',
+        24: 'inhr',
+        38: 'METERS',
+        42: 'MSEC',
+        45: 'MINUTES',
+        48: 'MPH',
+        49: 'MPS',
+        56: 'COUNT',
+        71: 'UV',
+        76: 'DEGREES',
+        82: 'MM',
+        83: 'KM',
+        105: 'INCHES',
+        106: 'ET',
+        116: 'MILES',
+        117: 'MB',
+        118: 'HPA',
+        }
+
+# Index (uom 25) drivers need their own editor
+DRIVER_EDITOR = {
+        'ST': 'STATUS',
+        'GV13': 'CONDITIONS',
+        'GV19': 'DAY',
+        }
+
+# Driver names, shared by all nodes (nls="ctl")
+DRIVER_NAMES = [
+        ('ST', 'NodeServer Status'),
+        ('CLITEMP', 'Temperature'),
+        ('CLIHUM', 'Humidity'),
+        ('BARPRES', 'Pressure'),
+        ('DEWPT', 'Dew Point'),
+        ('WINDDIR', 'Wind Direction'),
+        ('LUMIN', 'Light'),
+        ('GV0', 'High Temperature'),
+        ('GV1', 'Low Temperature'),
+        ('GV2', 'Feels Like'),
+        ('GV3', 'Average Temperature'),
+        ('GV4', 'Wind Speed'),
+        ('GV5', 'Gust Speed'),
+        ('GV6', 'Rain Today'),
+        ('GV7', 'ETo Today'),
+        ('GV8', 'Irrigation Runtime'),
+        ('GV9', 'Water Deficit'),
+        ('GV10', 'Elevation'),
+        ('GV11', 'Climate Coverage'),
+        ('GV12', 'Climate Intensity'),
+        ('GV13', 'Climate Conditions'),
+        ('GV14', 'Cloud Conditions'),
+        ('GV15', 'Visibility'),
+        ('GV16', 'UV Index'),
+        ('GV17', 'Ozone'),
+        ('GV18', 'Chance of Rain'),
+        ('GV19', 'Day'),
+        ('GV20', 'Evapotranspiration'),
+        ('GV21', 'Days Until Irrigation'),
+        ('GV22', 'HTTP Latency'),
+        ('GV23', 'Errors'),
+        ('GV24', 'Requests Remaining'),
+        ('GV25', 'Driver Updates'),
+        ]
+
+COMMAND_NAMES = {
+        'DISCOVER': 'Re-Discover',
+        'UPDATE_PROFILE': 'Update Profile',
+        'REMOVE_NOTICES_ALL': 'Remove Notices',
+        'BACKFILL': 'Backfill History',
+        'IRRIGATED': 'Irrigated',
+        }
+
+# Static index tables
+DAYS = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+RAIN_TYPES = ['None', 'Rain', 'Hail', 'Rain & Hail']
+TRENDS = ['Falling', 'Steady', 'Rising']
+STATUS = ['Offline', 'Online', 'Stale']
+CARDINAL = ['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
+            'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW']
+CONDITIONS = [
+        (1000, 'Sunny'),
+        (1003, 'Partly cloudy'),
+        (1006, 'Cloudy'),
+        (1009, 'Overcast'),
+        (1030, 'Mist'),
+        (1063, 'Patchy rain possible'),
+        (1066, 'Patchy snow possible'),
+        (1069, 'Patchy sleet possible'),
+        (1072, 'Patchy freezing drizzle possible'),
+        (1087, 'Thundery outbreaks possible'),
+        (1114, 'Blowing snow'),
+        (1117, 'Blizzard'),
+        (1135, 'Fog'),
+        (1147, 'Freezing fog'),
+        (1150, 'Patchy light drizzle'),
+        (1153, 'Light drizzle'),
+        (1168, 'Freezing drizzle'),
+        (1171, 'Heavy freezing drizzle'),
+        (1180, 'Patchy light rain'),
+        (1183, 'Light rain'),
+        (1186, 'Moderate rain at times'),
+        (1189, 'Moderate rain'),
+        (1192, 'Heavy rain at times'),
+        (1195, 'Heavy rain'),
+        (1198, 'Light freezing rain'),
+        (1201, 'Moderate or heavy freezing rain'),
+        (1204, 'Light sleet'),
+        (1207, 'Moderate or heavy sleet'),
+        (1210, 'Patchy light snow'),
+        (1213, 'Light snow'),
+        (1216, 'Patchy moderate snow'),
+        (1219, 'Moderate snow'),
+        (1222, 'Patchy heavy snow'),
+        (1225, 'Heavy snow'),
+        (1237, 'Ice pellets'),
+        (1240, 'Light rain shower'),
+        (1243, 'Moderate or heavy rain shower'),
+        (1246, 'Torrential rain shower'),
+        (1249, 'Light sleet showers'),
+        (1252, 'Moderate or heavy sleet showers'),
+        (1255, 'Light snow showers'),
+        (1258, 'Moderate or heavy snow showers'),
+        (1261, 'Light showers of ice pellets'),
+        (1264, 'Moderate or heavy showers of ice pellets'),
+        (1273, 'Patchy light rain with thunder'),
+        (1276, 'Moderate or heavy rain with thunder'),
+        (1279, 'Patchy light snow with thunder'),
+        (1282, 'Moderate or heavy snow with thunder'),
+        ]
+NIGHT_CONDITIONS = {1000: 'Clear'}
+
+
+class NodeDef(object):
+    def __init__(self, id, name, drivers, commands=(), nls='ctl'):
+        self.id = id
+        self.name = name
+        self.drivers = drivers
+        self.commands = list(commands)
+        self.nls = nls
+
+
+def editor_for(driver):
+    if driver['driver'] in DRIVER_EDITOR:
+        return DRIVER_EDITOR[driver['driver']]
+    return UOM_EDITOR[driver['uom']]
+
+
+def render_nodedefs(nodes):
+    lines = ['<nodeDefs>']
+    for node in nodes:
+        lines.append('  <nodeDef id="%s" nodeType="139" nls="%s">' % (node.id, node.nls))
+        lines.append('    <editors />')
+        lines.append('    <sts>')
+        for driver in node.drivers:
+            lines.append('      <st id="%s" editor="%s" />' % (driver['driver'], editor_for(driver)))
+        lines.append('    </sts>')
+        lines.append('    <cmds>')
+        lines.append('      <sends />')
+        lines.append('      <accepts>')
+        for cmd in node.commands:
+            lines.append('        <cmd id="%s" />' % cmd)
+        lines.append('      </accepts>')
+        lines.append('    </cmds>')
+        lines.append('  </nodeDef>')
+        lines.append('')
+    lines.append('</nodeDefs>')
+    return '\n'.join(lines) + '\n'
+
+
+def render_editors():
+    lines = ['<editors>']
+    for id, attributes in EDITORS:
+        lines.append('    <editor id="%s">' % id)
+        lines.append('        <range %s />' % attributes)
+        lines.append('    </editor>')
+    lines.append('')
+    lines.append('</editors>')
+    return '\n'.join(lines) + '\n'
+
+
+def render_nls(nodes):
+    names = dict(DRIVER_NAMES)
+    lines = []
+
+    for node in nodes:
+        for driver in node.drivers:
+            if driver['driver'] not in names:
+                raise ValueError('No name for driver %s of node %s' % (driver['driver'], node.id))
+
+    # The controller is first, it gets the commands and driver names
+    controller = nodes[0]
+    lines.append('# controller')
+    lines.append('ND-%s-NAME = %s' % (controller.id, controller.name))
+    lines.append('ND-%s-ICON = Weather' % controller.id)
+    commands = []
+    for node in nodes:
+        commands.extend([cmd for cmd in node.commands if cmd not in commands])
+    for cmd in commands:
+        lines.append('CMD-%s-%s-NAME = %s' % (controller.nls, cmd, COMMAND_NAMES[cmd]))
+    for driver, name in DRIVER_NAMES:
+        lines.append('ST-%s-%s-NAME = %s' % (controller.nls, driver, name))
+    lines.append('')
+
+    for node in nodes[1:]:
+        lines.append('ND-%s-NAME = %s' % (node.id, node.name))
+        lines.append('ND-%s-ICON = Weather' % node.id)
+        lines.append('')
+
+    def table(prefix, entries):
+        for index, text in entries:
+            lines.append('%s-%d = %s' % (prefix, index, text))
+        lines.append('')
+
+    table('EN_RAINTYPE', enumerate(RAIN_TYPES))
+    table('EN_DAY', enumerate(DAYS))
+    table('EN_TREND', enumerate(TRENDS))
+    table('EN_STATUS', enumerate(STATUS))
+    table('EN_CARDINAL', enumerate(CARDINAL))
+    table('EN_WIND_DIRECTION', enumerate(CARDINAL))
+    table('EN_DAY_CONDITION', CONDITIONS)
+    table('EN_NIGHT_CONDITION', [(code, NIGHT_CONDITIONS.get(code, text)) for code, text in CONDITIONS])
+
+    return '\n'.join(lines[:-1]) + '\n'
+
+
+# Render all of the profile files, returns {relative path: contents}
+def render(nodes):
+    return {
+            NODEDEF_FILE: render_nodedefs(nodes),
+            EDITOR_FILE: render_editors(),
+            NLS_FILE: render_nls(nodes),
+            }
+
+
+# Compare the rendered files with what's in profile_dir, returns a list
+# of the files that differ.
+def check_profile(nodes, profile_dir=PROFILE_DIR):
+    return different_files(render(nodes), profile_dir)
+
+
+def different_files(files, profile_dir):
+    different = []
+    for path, contents in files.items():
+        try:
+            with open(os.path.join(profile_dir, path), 'r') as f:
+                if f.read() == contents:
+                    continue
+        except OSError:
+            pass
+        different.append(path)
+    return different
+
+
+# Render the profile and write out the files that differ from the ones in
+# profile_dir.  The files on disk are what counts, an update that puts the
+# checked in (imperial) files back is noticed.  Returns True if files were
+# written and the profile needs to be installed.
+def write_profile(logger, nodes, profile_dir=PROFILE_DIR):
+    files = render(nodes)
+    different = different_files(files, profile_dir)
+    if len(different) == 0:
+        logger.info('Profile is up to date')
+        return False
+
+    for path in different:
+        full_path = os.path.join(profile_dir, path)
+        logger.info('Writing %s' % full_path)
+        with open(full_path, 'w') as f:
+            f.write(files[path])
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+    import sys
+    import polystub
+    polystub.install()
+    import weatherstack
+
+    parser = argparse.ArgumentParser(description='Check or rebuild the node server profile')
+    parser.add_argument('--units', default='imperial', choices=['imperial', 'metric'])
+    parser.add_argument('--write', action='store_true', help='write the profile files')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    nodes = weatherstack.profile_nodes(args.units)
+    if args.write:
+        write_profile(logging.getLogger('profile'), nodes)
+    else:
+        different = check_profile(nodes)
+        for path in different:
+            print('%s is out of date' % os.path.join(PROFILE_DIR, path))
+        if different:
+            sys.exit(1)
+        print('profile is up to date')